@@ -0,0 +1,93 @@
+import hashlib
+import io
+import os
+import tarfile
+import threading
+from typing import Callable, Iterator, Optional
+
+
+def content_hash(host_path: str) -> str:
+    """
+    计算宿主机文件或目录内容的哈希值（包含相对路径、权限和文件内容）
+    
+    参数:
+        host_path: 宿主机上的文件或目录路径
+        
+    返回:
+        sha256十六进制字符串
+    """
+    digest = hashlib.sha256()
+    root = host_path.rstrip('/')
+    if os.path.isdir(root):
+        paths = []
+        for dirpath, dirnames, filenames in os.walk(root):
+            dirnames.sort()
+            for name in sorted(dirnames + filenames):
+                paths.append(os.path.join(dirpath, name))
+    else:
+        paths = [root]
+    
+    for path in paths:
+        rel_path = os.path.relpath(path, os.path.dirname(root))
+        st = os.lstat(path)
+        digest.update(f"{rel_path}\0{st.st_mode}\0".encode('utf-8'))
+        if os.path.isfile(path) and not os.path.islink(path):
+            with open(path, 'rb') as f:
+                for chunk in iter(lambda: f.read(1 << 20), b''):
+                    digest.update(chunk)
+        elif os.path.islink(path):
+            digest.update(os.readlink(path).encode('utf-8'))
+    return digest.hexdigest()
+
+
+def build_tar(host_path: str) -> bytes:
+    """
+    将宿主机文件或目录打包为tar数据
+    
+    参数:
+        host_path: 宿主机上的文件或目录路径
+        
+    返回:
+        tar格式的字节数据
+    """
+    tar_stream = io.BytesIO()
+    with tarfile.open(fileobj=tar_stream, mode='w') as tar:
+        # 目录和文件都以其基本名称作为归档内的根
+        tar.add(host_path, arcname=os.path.basename(host_path.rstrip('/')))
+    return tar_stream.getvalue()
+
+
+class ArchiveStream:
+    """
+    从Docker守护进程流式读取的tar数据
+
+    数据读取完毕、读取出错或调用 close() 时关闭HTTP响应并执行一次 on_close 回调；
+    即使从未开始迭代，close() 也会释放资源（例如WSGI服务器处理HEAD请求时只调用 close()）。
+    """
+    def __init__(self, response, chunk_size: int, on_close: Callable[[], None]):
+        """
+        参数:
+            response: 以 stream=True 发起的HTTP响应
+            chunk_size: 每个数据块的大小（字节）
+            on_close: 关闭时的回调，只会执行一次
+        """
+        self._response = response
+        self._chunk_size = chunk_size
+        self._on_close: Optional[Callable[[], None]] = on_close
+        self._lock = threading.Lock()
+
+    def __iter__(self) -> Iterator[bytes]:
+        try:
+            yield from self._response.iter_content(self._chunk_size, False)
+        finally:
+            self.close()
+
+    def close(self) -> None:
+        with self._lock:
+            on_close, self._on_close = self._on_close, None
+        if on_close is None:
+            return
+        try:
+            self._response.close()
+        finally:
+            on_close()
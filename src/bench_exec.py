@@ -0,0 +1,90 @@
+import argparse
+import logging
+import os
+import subprocess
+import tempfile
+import time
+from config import SandboxConfig
+from sandbox import SandboxFactory
+
+
+class CountingSink:
+    """只统计字节数的输出目标，用于测量纯读取吞吐量"""
+    def __init__(self):
+        self.size = 0
+
+    def write(self, data):
+        self.size += len(data)
+        return len(data)
+
+
+def bench_line_mode(sandbox, command):
+    """原有方式：文本模式逐行读取"""
+    process = sandbox.exec(command, stderr=subprocess.DEVNULL)
+    size = 0
+    for line in process.stdout:
+        size += len(line)
+    process.wait()
+    return size
+
+
+def bench_readinto(sandbox, command):
+    """二进制模式：可复用缓冲区 readinto"""
+    sink = CountingSink()
+    sandbox.exec_to(command, sink)
+    return sink.size
+
+
+def bench_file(sandbox, command):
+    """二进制模式：输出直接写入宿主机文件"""
+    with tempfile.NamedTemporaryFile(delete=False) as f:
+        path = f.name
+    try:
+        sandbox.exec_to(command, path)
+        return os.path.getsize(path)
+    finally:
+        os.remove(path)
+
+
+def main():
+    """对比文本行模式和二进制模式的exec输出吞吐量"""
+    parser = argparse.ArgumentParser(description="exec输出吞吐量基准测试")
+    parser.add_argument("--image-name", default="sandbox")
+    parser.add_argument("--image-tag", default="2.0.0")
+    parser.add_argument("--size-mb", type=int, default=256, help="每轮命令输出的数据量（MB）")
+    parser.add_argument("--rounds", type=int, default=3)
+    args = parser.parse_args()
+    # 基准测试只输出警告以上的日志，避免日志输出影响测量
+    logging.basicConfig(level=logging.WARNING, format="%(asctime)s %(levelname)s %(name)s: %(message)s")
+
+    config = SandboxConfig(image_name=args.image_name, image_tag=args.image_tag)
+    factory = SandboxFactory.get_instance(config)
+    session_id = f"bench_exec_{os.getpid()}"
+    sandbox = factory.run(session_id)
+    if not sandbox:
+        print("沙盒创建失败")
+        return
+
+    # base64 输出为带换行的文本，行模式也能正确处理，保证对比公平
+    command = ["bash", "-c", f"head -c {args.size_mb * 3 // 4}M /dev/zero | base64"]
+    cases = [
+        ("行模式 (universal_newlines=True, bufsize=1)", bench_line_mode),
+        ("二进制 readinto (exec_to -> 对象)", bench_readinto),
+        ("二进制直写文件 (exec_to -> 路径)", bench_file),
+    ]
+    try:
+        for name, func in cases:
+            best = None
+            size = 0
+            for _ in range(args.rounds):
+                start = time.perf_counter()
+                size = func(sandbox, command)
+                elapsed = time.perf_counter() - start
+                best = elapsed if best is None else min(best, elapsed)
+            print(f"{name}: {size / 1024 / 1024:.1f} MB, 最佳 {best:.2f} 秒, {size / 1024 / 1024 / best:.1f} MB/s")
+    finally:
+        factory.remove(session_id)
+
+
+if __name__ == "__main__":
+    main()
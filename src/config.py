@@ -1,5 +1,28 @@
-from dataclasses import dataclass
-from typing import Optional, Dict
+from dataclasses import dataclass, field
+from typing import Optional, Dict, List, Tuple
+
+@dataclass
+class EndpointConfig:
+    """
+    Docker守护进程端点配置
+    """
+    # 端点名称，用于路由和排空
+    name: str = "default"
+    # Docker守护进程地址，例如 "unix:///var/run/docker.sock" 或 "tcp://10.0.0.2:2375"，
+    # 为None时使用环境变量 (docker.from_env)
+    base_url: Optional[str] = None
+    # 该端点最多容纳的沙盒数，None表示不限制
+    capacity: Optional[int] = None
+
+@dataclass
+class SetupRecipe:
+    """
+    沙盒准备步骤，构建一次后提交为镜像并按内容哈希复用
+    """
+    # 需要上传的文件: (宿主机文件或目录路径, 容器中的目标目录)，先于命令执行
+    files: List[Tuple[str, str]] = field(default_factory=list)
+    # 依次执行的shell命令，在容器工作目录中通过 bash -c 执行
+    commands: List[str] = field(default_factory=list)
 
 @dataclass
 class SandboxConfig:
@@ -23,4 +46,48 @@ class SandboxConfig:
     # 容器安全设置
     privileged: bool = False
     # 容器环境变量
-    environment: Optional[Dict[str, str]] = None 
\ No newline at end of file
+    environment: Optional[Dict[str, str]] = None
+    # 批量上传的默认并发数
+    upload_concurrency: int = 8
+    # 按内容哈希缓存的上传归档数量上限
+    archive_cache_size: int = 16
+    # 上传归档缓存的总字节数上限，超过该大小的单个归档不缓存
+    archive_cache_bytes: int = 256 * 1024 * 1024
+    # 启动脚本在桌面服务就绪后输出到容器日志的标记
+    ready_marker: Optional[str] = "SANDBOX_READY"
+    # 等待沙盒就绪的默认超时时间（秒）
+    ready_timeout: float = 60.0
+    # 工厂名称，写入容器标签，用于事件过滤和识别本工厂创建的容器
+    factory_name: str = "default"
+    # Docker守护进程端点列表，为None时只使用环境变量指定的守护进程
+    endpoints: Optional[List[EndpointConfig]] = None
+    # 沙盒放置策略: least_loaded (负载最低) 或 bin_pack (优先填满)
+    placement: str = "least_loaded"
+    # 批量启动沙盒（如分叉副本）的并发数
+    launch_concurrency: int = 8
+    # 会话启动前的准备步骤，为None时直接使用基础镜像
+    setup_recipe: Optional[SetupRecipe] = None
+    # 准备步骤镜像缓存在每个端点上占用的磁盘上限（字节），None表示不限制
+    image_cache_budget: Optional[int] = None
+    # 垃圾回收周期（秒），None表示不启动后台回收，可手动调用 collect_garbage
+    gc_interval: Optional[float] = None
+    # 沙盒最长空闲时间（秒），None表示不限制
+    idle_ttl: Optional[float] = None
+    # 沙盒最长存活时间（秒），None表示不限制
+    max_lifetime: Optional[float] = None
+    # 新创建容器和快照镜像在孤儿回收中的保护期（秒）
+    orphan_grace: float = 60.0
+    # 垃圾回收并行删除的最大数量
+    gc_concurrency: int = 8
+    # 全局同时进行的exec和文件传输数量上限，None表示不限制
+    exec_global_limit: Optional[int] = None
+    # 单个会话同时进行的exec和文件传输数量上限，None表示不限制
+    exec_session_limit: Optional[int] = None
+    # exec和文件传输的最长排队时间（秒），None表示一直等待
+    exec_queue_timeout: Optional[float] = None
+    # 追踪数据写入的本地JSON Lines文件，None表示不写文件
+    trace_file: Optional[str] = None
+    # 追踪数据的采集服务地址，None表示不上报
+    trace_collector_url: Optional[str] = None
+    # 每个端点Docker客户端的连接池大小，流式文件传输每个占用一个连接，应不小于并发请求数
+    docker_pool_size: int = 10
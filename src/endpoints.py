@@ -0,0 +1,107 @@
+import threading
+from typing import List, Optional
+from urllib.parse import urlparse
+
+import docker
+
+from config import EndpointConfig
+
+
+class DockerEndpoint:
+    """
+    一个Docker守护进程端点，持有自己的客户端、容量和当前负载
+    """
+    def __init__(self, config: EndpointConfig, max_pool_size: int = 10):
+        """
+        参数:
+            config: 端点配置
+            max_pool_size: Docker客户端的连接池大小
+        """
+        self.name = config.name
+        self.base_url = config.base_url
+        self.capacity = config.capacity
+        if config.base_url:
+            self.client = docker.DockerClient(base_url=config.base_url, max_pool_size=max_pool_size)
+        else:
+            self.client = docker.from_env(max_pool_size=max_pool_size)
+        self.active = 0  # 当前放置在该端点上的沙盒数（含正在创建的）
+        self.draining = False
+        self.event_watcher = None
+        self._cond = threading.Condition()
+
+    @property
+    def host(self) -> str:
+        """
+        端点所在主机地址，用于探测映射到宿主机的端口
+        """
+        if self.base_url:
+            parsed = urlparse(self.base_url)
+            if parsed.scheme in ("tcp", "http", "https", "ssh") and parsed.hostname:
+                return parsed.hostname
+        return "127.0.0.1"
+
+    def has_room(self) -> bool:
+        """
+        是否可以继续放置新的沙盒
+        """
+        return not self.draining and (self.capacity is None or self.active < self.capacity)
+
+    def load(self) -> float:
+        """
+        当前负载，有容量限制时为占用比例，否则为沙盒数
+        """
+        if self.capacity:
+            return self.active / self.capacity
+        return float(self.active)
+
+    def acquire(self) -> None:
+        with self._cond:
+            self.active += 1
+
+    def release(self) -> None:
+        with self._cond:
+            self.active = max(self.active - 1, 0)
+            if self.active == 0:
+                self._cond.notify_all()
+
+    def wait_empty(self, timeout: Optional[float] = None) -> bool:
+        """
+        等待该端点上的沙盒全部被删除
+
+        返回:
+            超时前是否已清空
+        """
+        with self._cond:
+            return self._cond.wait_for(lambda: self.active == 0, timeout)
+
+    def close(self) -> None:
+        """
+        停止事件监听并关闭客户端
+        """
+        if self.event_watcher is not None:
+            self.event_watcher.stop()
+        try:
+            self.client.close()
+        except Exception:
+            pass
+
+
+def select_endpoint(endpoints: List[DockerEndpoint], strategy: str) -> Optional[DockerEndpoint]:
+    """
+    按放置策略选择端点
+
+    参数:
+        endpoints: 候选端点列表（按配置顺序）
+        strategy: least_loaded 选择负载最低的端点；bin_pack 优先填满负载最高且仍有余量的端点
+
+    返回:
+        选中的端点，没有可用端点时返回None
+    """
+    candidates = [endpoint for endpoint in endpoints if endpoint.has_room()]
+    if not candidates:
+        return None
+    if strategy == "bin_pack":
+        return max(candidates, key=lambda endpoint: endpoint.load())
+    if strategy == "least_loaded":
+        return min(candidates, key=lambda endpoint: endpoint.load())
+    raise ValueError(f"未知的放置策略: {strategy}")
@@ -0,0 +1,103 @@
+import logging
+import threading
+from typing import Any, Callable, Dict, List, Optional
+
+import docker
+
+logger = logging.getLogger(__name__)
+
+# 容器事件 -> 沙盒状态
+EVENT_STATES = {
+    "start": "running",
+    "restart": "running",
+    "unpause": "running",
+    "pause": "paused",
+    "die": "exited",
+    "oom": "oom",
+    "destroy": "removed",
+}
+
+
+class ContainerEventWatcher:
+    """
+    Docker事件监听器，通过一条按标签过滤的事件流实时获取容器状态变化
+
+    连接断开时按指数退避重连，每次（重新）连接成功后调用 on_resync，
+    以便调用方通过一次列表查询补齐断线期间丢失的事件。
+    """
+    def __init__(self, client: docker.DockerClient, labels: List[str],
+                 on_event: Callable[[str, str, Dict[str, Any]], None],
+                 on_resync: Optional[Callable[[], None]] = None,
+                 max_backoff: float = 30.0):
+        """
+        参数:
+            client: Docker客户端
+            labels: 事件过滤标签，形如 "key=value"
+            on_event: 事件回调，参数为 (容器ID, 事件动作, 事件属性)
+            on_resync: 连接建立后的重新同步回调
+            max_backoff: 重连的最大等待时间（秒）
+        """
+        self.client = client
+        self.labels = labels
+        self.on_event = on_event
+        self.on_resync = on_resync
+        self.max_backoff = max_backoff
+        self._stream = None
+        self._stopped = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self) -> None:
+        """
+        启动后台监听线程
+        """
+        if self._thread is not None and self._thread.is_alive():
+            return
+        self._stopped.clear()
+        self._thread = threading.Thread(target=self._loop, name="sandbox-events", daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        """
+        停止监听并关闭事件流
+        """
+        self._stopped.set()
+        stream = self._stream
+        if stream is not None:
+            try:
+                stream.close()
+            except Exception:
+                pass
+
+    def _loop(self) -> None:
+        backoff = 0.5
+        while not self._stopped.is_set():
+            try:
+                self._stream = self.client.events(
+                    decode=True,
+                    filters={"type": "container", "label": self.labels}
+                )
+                # 先订阅再同步，避免两者之间的事件丢失
+                if self.on_resync is not None:
+                    self.on_resync()
+                backoff = 0.5
+                for event in self._stream:
+                    if self._stopped.is_set():
+                        break
+                    action = (event.get("Action") or event.get("status") or "").split(":")[0]
+                    container_id = event.get("id") or event.get("Actor", {}).get("ID")
+                    if not container_id or action not in EVENT_STATES:
+                        continue
+                    attributes = event.get("Actor", {}).get("Attributes", {})
+                    try:
+                        self.on_event(container_id, action, attributes)
+                    except Exception as e:
+                        logger.error("处理容器事件时出错: %s", e)
+            except Exception as e:
+                if self._stopped.is_set():
+                    break
+                logger.warning("Docker事件流中断，%.1f 秒后重连: %s", backoff, e)
+            finally:
+                self._stream = None
+            if self._stopped.wait(backoff):
+                break
+            backoff = min(backoff * 2, self.max_backoff)
@@ -0,0 +1,219 @@
+import hashlib
+import json
+import logging
+import threading
+from collections import OrderedDict
+from typing import Dict, Optional, Tuple
+
+import docker
+
+from archive import build_tar, content_hash
+from config import SetupRecipe
+from labels import LABEL_FORK_OF
+
+logger = logging.getLogger(__name__)
+
+# 准备步骤镜像的仓库名和标签
+RECIPE_REPOSITORY = "sandbox-recipe"
+LABEL_RECIPE_HASH = "sandbox.recipe_hash"
+LABEL_RECIPE_BASE = "sandbox.recipe_base"
+
+
+def recipe_hash(base_image_id: str, recipe: SetupRecipe, working_dir: str,
+                environment: Optional[Dict[str, str]] = None) -> str:
+    """
+    计算准备步骤的内容哈希，基础镜像、上传文件内容、命令或执行环境任一变化都会得到不同的哈希
+
+    参数:
+        base_image_id: 基础镜像ID
+        recipe: 准备步骤
+        working_dir: 命令执行的工作目录
+        environment: 命令执行的环境变量
+    """
+    payload = {
+        "base": base_image_id,
+        "working_dir": working_dir,
+        "environment": sorted((environment or {}).items()),
+        "files": [[container_path, content_hash(host_path)] for host_path, container_path in recipe.files],
+        "commands": list(recipe.commands),
+    }
+    return hashlib.sha256(json.dumps(payload, sort_keys=True).encode('utf-8')).hexdigest()
+
+
+class RecipeImageCache:
+    """
+    准备步骤镜像缓存
+
+    首次遇到某个准备步骤时在临时容器中执行并提交为镜像，之后直接复用；
+    每个端点独立维护LRU顺序，缓存镜像的总大小超过磁盘预算时删除最久未使用且未被容器占用的镜像。
+    """
+    def __init__(self, labels: Dict[str, str], budget: Optional[int] = None):
+        """
+        参数:
+            labels: 写入缓存镜像的附加标签（如工厂标签）
+            budget: 每个端点上缓存镜像的磁盘上限（字节），None表示不限制
+        """
+        self.labels = labels
+        self.budget = budget
+        # 端点名称 -> OrderedDict(配方哈希 -> (镜像ID, 大小))，按最近使用排序
+        self._entries: Dict[str, "OrderedDict[str, Tuple[str, int]]"] = {}
+        self._lock = threading.Lock()
+        self._build_locks: Dict[Tuple[str, str], threading.Lock] = {}
+
+    def get_or_build(self, endpoint, base_image: str, recipe: SetupRecipe,
+                     working_dir: str, environment: Optional[Dict[str, str]] = None) -> str:
+        """
+        获取准备步骤对应的镜像，未命中时构建
+
+        参数:
+            endpoint: 目标Docker端点
+            base_image: 基础镜像名称
+            recipe: 准备步骤
+            working_dir: 命令执行的工作目录
+            environment: 命令执行的环境变量
+
+        返回:
+            镜像ID，构建失败时抛出异常
+        """
+        client = endpoint.client
+        base = client.images.get(base_image)
+        key = recipe_hash(base.id, recipe, working_dir, environment)
+        entries = self._load_entries(endpoint)
+
+        with self._lock:
+            build_lock = self._build_locks.setdefault((endpoint.name, key), threading.Lock())
+
+        # 同一端点上相同配方只构建一次，并发的会话等待构建完成
+        with build_lock:
+            with self._lock:
+                cached = entries.get(key)
+                if cached is not None:
+                    entries.move_to_end(key)
+            if cached is not None:
+                try:
+                    client.images.get(cached[0])
+                    logger.debug("准备步骤镜像缓存命中: %s (端点: %s)", key[:16], endpoint.name)
+                    return cached[0]
+                except docker.errors.ImageNotFound:
+                    # 镜像已被外部删除，重新构建
+                    with self._lock:
+                        entries.pop(key, None)
+
+            image = self._build(client, base, key, recipe, working_dir, environment)
+            size = max(image.attrs.get("Size", 0) - base.attrs.get("Size", 0), 0)
+            with self._lock:
+                entries[key] = (image.id, size)
+                entries.move_to_end(key)
+        self._evict(endpoint, keep=key)
+        return image.id
+
+    def _load_entries(self, endpoint) -> "OrderedDict[str, Tuple[str, int]]":
+        """
+        首次使用某个端点时，从已有的缓存镜像恢复LRU记录（按创建时间排序）
+
+        只接受 sandbox-recipe 仓库中的镜像，跳过带有缓存标签的分叉快照等其他镜像
+        """
+        with self._lock:
+            entries = self._entries.get(endpoint.name)
+            if entries is not None:
+                return entries
+
+        entries = OrderedDict()
+        try:
+            images = endpoint.client.images.list(filters={"label": LABEL_RECIPE_HASH})
+            base_sizes: Dict[str, int] = {}
+            for image in sorted(images, key=lambda image: image.attrs.get("Created", "")):
+                labels = image.labels or {}
+                if (not labels.get(LABEL_RECIPE_HASH) or LABEL_FORK_OF in labels or
+                        not any(tag.startswith(f"{RECIPE_REPOSITORY}:") for tag in image.tags)):
+                    continue
+                base_id = labels.get(LABEL_RECIPE_BASE)
+                if base_id and base_id not in base_sizes:
+                    try:
+                        base_sizes[base_id] = endpoint.client.images.get(base_id).attrs.get("Size", 0)
+                    except docker.errors.ImageNotFound:
+                        base_sizes[base_id] = 0
+                size = max(image.attrs.get("Size", 0) - base_sizes.get(base_id, 0), 0)
+                entries[labels[LABEL_RECIPE_HASH]] = (image.id, size)
+        except Exception as e:
+            logger.warning("读取准备步骤镜像缓存失败 (端点: %s): %s", endpoint.name, e)
+
+        with self._lock:
+            return self._entries.setdefault(endpoint.name, entries)
+
+    def _build(self, client: docker.DockerClient, base, key: str, recipe: SetupRecipe,
+               working_dir: str, environment: Optional[Dict[str, str]]):
+        """
+        在临时容器中执行准备步骤并提交为镜像
+        """
+        logger.info("构建准备步骤镜像: %s，文件 %s 个，命令 %s 条", key[:16], len(recipe.files), len(recipe.commands))
+        container = client.containers.run(
+            base.id,
+            command=["tail", "-f", "/dev/null"],
+            working_dir=working_dir,
+            environment=environment,
+            detach=True
+        )
+        try:
+            for host_path, container_path in recipe.files:
+                container.put_archive(container_path, build_tar(host_path))
+
+            for command in recipe.commands:
+                exit_code, output = container.exec_run(
+                    ["bash", "-c", command], workdir=working_dir, environment=environment
+                )
+                if exit_code != 0:
+                    tail = (output or b"").decode('utf-8', errors='replace')[-2000:]
+                    raise RuntimeError(f"准备命令执行失败 (退出码 {exit_code}): {command}\n{tail}")
+
+            # 恢复基础镜像的启动命令，避免把临时容器的 tail 命令写入镜像
+            base_config = base.attrs.get("Config", {})
+            labels = dict(base_config.get("Labels") or {})
+            labels.update(self.labels)
+            labels[LABEL_RECIPE_HASH] = key
+            labels[LABEL_RECIPE_BASE] = base.id
+            image = container.commit(
+                repository=RECIPE_REPOSITORY,
+                tag=key[:16],
+                conf={
+                    "Cmd": base_config.get("Cmd"),
+                    "Entrypoint": base_config.get("Entrypoint"),
+                    "Labels": labels,
+                }
+            )
+            logger.info("准备步骤镜像构建完成: %s:%s", RECIPE_REPOSITORY, key[:16])
+            return image
+        finally:
+            try:
+                container.remove(force=True)
+            except Exception as e:
+                logger.warning("清理构建容器时出错: %s", e)
+
+    def _evict(self, endpoint, keep: Optional[str] = None) -> None:
+        """
+        缓存总大小超过预算时，按最久未使用的顺序删除镜像；仍被容器使用的镜像会被跳过
+        """
+        if self.budget is None:
+            return
+        with self._lock:
+            entries = self._entries.get(endpoint.name)
+            if entries is None:
+                return
+            total = sum(size for _, size in entries.values())
+            candidates = [(key, value) for key, value in entries.items() if key != keep]
+
+        for key, (image_id, size) in candidates:
+            if total <= self.budget:
+                break
+            try:
+                endpoint.client.images.remove(image_id)
+            except docker.errors.ImageNotFound:
+                pass
+            except docker.errors.APIError as e:
+                # 镜像仍被容器使用时无法删除，保留到下次淘汰
+                logger.warning("跳过淘汰准备步骤镜像 %s: %s", key[:16], e)
+                continue
+            with self._lock:
+                entries.pop(key, None)
+            total -= size
+            logger.info("已淘汰准备步骤镜像 %s，释放约 %s 字节 (端点: %s)", key[:16], size, endpoint.name)
@@ -0,0 +1,4 @@
+# 工厂创建的容器和镜像标签，用于事件过滤和归属识别
+LABEL_FACTORY = "sandbox.factory"
+LABEL_SESSION = "sandbox.session_id"
+LABEL_FORK_OF = "sandbox.fork_of"
@@ -0,0 +1,244 @@
+import heapq
+import itertools
+import logging
+import socket
+import threading
+import time
+from calendar import timegm
+from typing import Callable, Dict, List, Optional, Tuple
+
+import docker
+
+logger = logging.getLogger(__name__)
+
+
+def _log_timestamp(logs: bytes) -> Optional[int]:
+    """
+    读取带时间戳的日志中最后一行的时间（Unix时间戳，精确到秒）
+    """
+    last = logs.rstrip(b"\n").rsplit(b"\n", 1)[-1]
+    try:
+        return timegm(time.strptime(last[:19].decode('ascii'), "%Y-%m-%dT%H:%M:%S"))
+    except (UnicodeDecodeError, ValueError):
+        return None
+
+
+class _ReadyWatch:
+    """
+    单个沙盒的就绪检测任务
+    """
+    def __init__(self, container_id: str, client: docker.DockerClient,
+                 ready_marker: Optional[str], probe_port: Optional[int],
+                 probe_host: str, initial_delay: float, max_delay: float):
+        self.container_id = container_id
+        self.client = client
+        self.ready_marker = ready_marker
+        self.probe_port = probe_port
+        self.probe_host = probe_host
+        self.delay = initial_delay
+        self.max_delay = max_delay
+        self.marker_seen = not ready_marker
+        # 下一次读取日志的起始时间，每次只读取新增的日志
+        self.log_since: Optional[int] = None
+        self.event = threading.Event()
+        self.ready = False
+        self.error: Optional[str] = None
+        self.callbacks: List[Callable[[bool], None]] = []
+        # 正在 wait() 中等待结果的调用方数量
+        self.waiters = 0
+
+
+class ReadinessWatcher:
+    """
+    沙盒就绪检测器，使用单个后台线程并发检测多个沙盒的桌面服务是否启动完成
+
+    检测方式:
+        1. 容器日志中出现启动脚本输出的就绪标记 (见 start.sh)
+        2. 如果映射了宿主机端口，再对该端口做一次TCP探测
+    每个沙盒按指数退避安排下一次检测，没有到期的任务时线程阻塞等待，不会忙轮询。
+    """
+    _instance = None
+    _lock = threading.Lock()
+
+    def __init__(self, initial_delay: float = 0.05, max_delay: float = 2.0,
+                 probe_timeout: float = 0.5):
+        self.initial_delay = initial_delay
+        self.max_delay = max_delay
+        self.probe_timeout = probe_timeout
+        self._heap: List[Tuple[float, int, _ReadyWatch]] = []
+        self._watches: Dict[str, _ReadyWatch] = {}
+        self._counter = itertools.count()
+        self._cond = threading.Condition()
+        self._thread: Optional[threading.Thread] = None
+
+    @classmethod
+    def get_instance(cls) -> 'ReadinessWatcher':
+        """
+        获取进程内共享的就绪检测器
+        """
+        if cls._instance is None:
+            with cls._lock:
+                if cls._instance is None:
+                    cls._instance = cls()
+        return cls._instance
+
+    def watch(self, container_id: str, client: docker.DockerClient,
+              ready_marker: Optional[str] = None, probe_port: Optional[int] = None,
+              probe_host: str = "127.0.0.1",
+              callback: Optional[Callable[[bool], None]] = None) -> threading.Event:
+        """
+        注册一个就绪检测任务，同一容器的重复注册会复用已有任务
+
+        参数:
+            container_id: 容器ID
+            client: 容器所在Docker守护进程的客户端
+            ready_marker: 容器日志中表示就绪的标记，为None时不检查日志
+            probe_port: 需要探测的宿主机端口，为None时不做端口探测
+            probe_host: 端口探测的主机地址
+            callback: 检测结束时的回调，参数为是否就绪
+
+        返回:
+            检测结束时被置位的事件
+        """
+        return self._register(container_id, client, ready_marker, probe_port,
+                              probe_host, callback).event
+
+    def wait(self, container_id: str, client: docker.DockerClient,
+             ready_marker: Optional[str] = None, probe_port: Optional[int] = None,
+             probe_host: str = "127.0.0.1", timeout: Optional[float] = None) -> bool:
+        """
+        注册检测任务并阻塞等待结果
+
+        返回:
+            超时前是否检测到就绪；最后一个等待者超时且没有回调时取消该检测任务
+        """
+        entry = self._register(container_id, client, ready_marker, probe_port, probe_host, waiter=True)
+        finished = entry.event.wait(timeout)
+        with self._cond:
+            entry.waiters -= 1
+            abandon = not finished and entry.waiters == 0 and not entry.callbacks
+        if abandon:
+            self._cancel_entry(entry)
+            return False
+        return finished and entry.ready
+
+    def _register(self, container_id: str, client: docker.DockerClient,
+                  ready_marker: Optional[str], probe_port: Optional[int], probe_host: str,
+                  callback: Optional[Callable[[bool], None]] = None,
+                  waiter: bool = False) -> _ReadyWatch:
+        with self._cond:
+            entry = self._watches.get(container_id)
+            if entry is None:
+                entry = _ReadyWatch(container_id, client, ready_marker, probe_port,
+                                    probe_host, self.initial_delay, self.max_delay)
+                self._watches[container_id] = entry
+                heapq.heappush(self._heap, (time.monotonic(), next(self._counter), entry))
+                self._ensure_thread()
+                self._cond.notify()
+            if callback is not None:
+                entry.callbacks.append(callback)
+            if waiter:
+                entry.waiters += 1
+            return entry
+
+    def cancel(self, container_id: str) -> None:
+        """
+        取消某个容器的就绪检测，等待者会收到未就绪的结果
+        """
+        with self._cond:
+            entry = self._watches.get(container_id)
+        if entry is not None:
+            self._cancel_entry(entry)
+
+    def _cancel_entry(self, entry: _ReadyWatch) -> None:
+        with self._cond:
+            if self._watches.get(entry.container_id) is not entry:
+                return
+            del self._watches[entry.container_id]
+        entry.error = "检测已取消"
+        self._finish(entry, False)
+
+    def _ensure_thread(self) -> None:
+        if self._thread is None or not self._thread.is_alive():
+            self._thread = threading.Thread(target=self._loop, name="sandbox-readiness", daemon=True)
+            self._thread.start()
+
+    def _loop(self) -> None:
+        while True:
+            with self._cond:
+                while not self._heap:
+                    self._cond.wait()
+                due, _, entry = self._heap[0]
+                now = time.monotonic()
+                if due > now:
+                    self._cond.wait(due - now)
+                    continue
+                heapq.heappop(self._heap)
+                if self._watches.get(entry.container_id) is not entry:
+                    continue
+
+            done, ready = self._check(entry)
+
+            with self._cond:
+                if self._watches.get(entry.container_id) is not entry:
+                    # 检测期间已被取消
+                    continue
+                if done:
+                    del self._watches[entry.container_id]
+                else:
+                    entry.delay = min(entry.delay * 2, entry.max_delay)
+                    heapq.heappush(self._heap, (time.monotonic() + entry.delay, next(self._counter), entry))
+            if done:
+                self._finish(entry, ready)
+
+    def _check(self, entry: _ReadyWatch) -> Tuple[bool, bool]:
+        """
+        执行一次检测
+
+        返回:
+            (检测是否结束, 是否就绪)
+        """
+        try:
+            if not entry.marker_seen:
+                container = entry.client.containers.get(entry.container_id)
+                if container.status in ("exited", "dead"):
+                    entry.error = f"容器已退出，状态: {container.status}"
+                    return True, False
+                # 按守护进程记录的时间戳增量读取，不再每次下载完整日志；
+                # since 精确到秒，与上次重叠的日志行不影响标记判断
+                logs = container.logs(stdout=True, stderr=True, timestamps=True, since=entry.log_since)
+                if entry.ready_marker.encode('utf-8') not in logs:
+                    if logs:
+                        entry.log_since = _log_timestamp(logs) or entry.log_since
+                    return False, False
+                entry.marker_seen = True
+
+            if entry.probe_port is not None:
+                try:
+                    with socket.create_connection((entry.probe_host, entry.probe_port),
+                                                  timeout=self.probe_timeout):
+                        pass
+                except OSError:
+                    # 端口未开放时确认容器仍在运行，容器退出或被删除后结束检测
+                    container = entry.client.containers.get(entry.container_id)
+                    if container.status in ("exited", "dead"):
+                        entry.error = f"容器已退出，状态: {container.status}"
+                        return True, False
+                    return False, False
+            return True, True
+        except docker.errors.NotFound:
+            entry.error = "容器不存在"
+            return True, False
+        except Exception as e:
+            # 临时性错误按退避重试
+            entry.error = str(e)
+            return False, False
+
+    def _finish(self, entry: _ReadyWatch, ready: bool) -> None:
+        entry.ready = ready
+        entry.event.set()
+        for callback in entry.callbacks:
+            try:
+                callback(ready)
+            except Exception as e:
+                logger.error("就绪回调执行出错: %s", e)
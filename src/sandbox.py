@@ -1,38 +1,251 @@
 import docker
 from docker.errors import NotFound, APIError
+from docker.utils import decode_json_header
+import logging
 import threading
 import subprocess
 import os
 import sys
 import tarfile
 import io
-from typing import Dict, List, Optional, Union, IO
-from config import SandboxConfig
+import time
+import uuid
+import tempfile
+import weakref
+from collections import OrderedDict
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, Iterator, List, Optional, Union, IO
+from config import SandboxConfig, EndpointConfig
+from archive import ArchiveStream, content_hash, build_tar
+from readiness import ReadinessWatcher
+from events import ContainerEventWatcher, EVENT_STATES
+from endpoints import DockerEndpoint, select_endpoint
+from image_cache import LABEL_RECIPE_BASE, LABEL_RECIPE_HASH, RecipeImageCache
+from labels import LABEL_FACTORY, LABEL_SESSION, LABEL_FORK_OF
+from sandbox_gc import SandboxCollector
+from scheduler import FairScheduler
+from screen import ScreenFrame, read_frames, HELPER_HOST_PATH, HELPER_CONTAINER_DIR, HELPER_CONTAINER_PATH
+from tracing import ContextLogger, configure_tracing, current_span, get_tracer
+
+logger = logging.getLogger(__name__)
+
+class SandboxRemovedError(RuntimeError):
+    """
+    沙盒的容器已被删除
+    """
+
+
+# 二进制模式下读取命令输出的缓冲区大小
+EXEC_BUFFER_SIZE = 1 << 20
+
 
 class Sandbox:
     """
     沙盒类，代表一个Docker容器实例
     """
-    def __init__(self, container_id: str, session_id: str, host_port: Optional[int] = None):
+    def __init__(self, container_id: str, session_id: str, host_port: Optional[int] = None,
+                 endpoint: Optional[DockerEndpoint] = None,
+                 ready_marker: Optional[str] = None,
+                 scheduler: Optional[FairScheduler] = None,
+                 queue_timeout: Optional[float] = None):
         self.container_id = container_id
         self.session_id = session_id
         self.host_port = host_port
+        # 容器所在的Docker端点，所有操作都路由到该端点
+        self.endpoint = endpoint
+        self.ready_marker = ready_marker
+        self.ready = False
+        # 容器状态: running / paused / exited / oom / removed，由工厂的事件监听器实时更新
+        self.state = "running"
+        self.exit_code: Optional[int] = None
+        # 创建时间和最近一次通过沙盒接口操作的时间，用于空闲回收
+        self.created_at = time.time()
+        self.last_active = self.created_at
+        # 分叉副本所使用的快照镜像ID，最后一个副本删除后由工厂删除该镜像
+        self.fork_image: Optional[str] = None
+        # exec和文件传输的并发调度器，None表示不限制
+        self.scheduler = scheduler
+        self.queue_timeout = queue_timeout
+        self._client = endpoint.client if endpoint is not None else None
         self._lock = threading.Lock()
+        self._screen_helper_ready = False
+        # 正在进行的文件传输数量和exec启动的进程，用于判断沙盒是否仍在使用
+        self._operations = 0
+        self._operations_lock = threading.Lock()
+        self._processes: "weakref.WeakSet[subprocess.Popen]" = weakref.WeakSet()
+        # 日志附带会话ID、容器ID和端点字段，可按字段过滤和聚合
+        self.log = ContextLogger(logger, {
+            "session_id": session_id,
+            "container_id": container_id,
+            "endpoint": endpoint.name if endpoint is not None else None,
+        })
+    
+    def _get_client(self) -> docker.DockerClient:
+        """
+        获取Docker客户端，优先使用所属端点的客户端
+        """
+        if self._client is None:
+            self._client = docker.from_env()
+        return self._client
+    
+    def _ensure_available(self) -> None:
+        """
+        容器已被删除时快速失败，避免再经过一次较慢的 containers.get；同时记录最近活动时间
+        """
+        if self.state == "removed":
+            raise SandboxRemovedError(f"沙盒 {self.session_id} 的容器 {self.container_id} 已被删除")
+        self.last_active = time.time()
         
+    def in_use(self) -> bool:
+        """
+        是否有正在进行的文件传输或仍在运行的exec进程，使用中时同时刷新最近活动时间
+        """
+        busy = self._operations > 0 or any(process.poll() is None for process in list(self._processes))
+        if busy:
+            self.last_active = time.time()
+        return busy
+    
+    @contextmanager
+    def _slot(self):
+        """
+        占用一个exec/文件传输名额，产出排队时间；排队超时抛出 TimeoutError
+        """
+        with self._operations_lock:
+            self._operations += 1
+        try:
+            if self.scheduler is None:
+                yield 0.0
+                return
+            with self.scheduler.slot(self.session_id, self.queue_timeout) as queue_time:
+                yield queue_time
+        finally:
+            with self._operations_lock:
+                self._operations -= 1
+            # 操作结束时刷新最近活动时间，耗时较长的操作不会被当作空闲
+            self.last_active = time.time()
+    
+    def _span(self, name: str, **attributes):
+        """
+        创建带有会话ID、容器ID和端点属性的追踪span，追踪关闭时返回空span
+        """
+        tracer = get_tracer()
+        if not tracer.enabled:
+            return tracer.span(name)
+        return tracer.span(name, session_id=self.session_id, container_id=self.container_id,
+                           endpoint=self.endpoint.name if self.endpoint is not None else None,
+                           **attributes)
+    
     def remove(self) -> bool:
         """
         删除沙盒（停止并删除容器）
+        
+        状态由工厂统一更新为 removed，沙盒同时从注册表中移除并通知状态回调
         """
         with self._lock:
             try:
-                client = docker.from_env()
+                client = self._get_client()
                 container = client.containers.get(self.container_id)
                 container.stop()
                 container.remove()
-                return True
+            except docker.errors.NotFound:
+                # 容器已被外部删除，视为删除成功
+                pass
             except Exception as e:
-                print(f"删除沙盒失败: {str(e)}")
+                self.log.error("删除沙盒失败: %s", e)
                 return False
+        SandboxFactory.get_instance()._set_state(self, "removed")
+        return True
+    
+    def wait_ready(self, timeout: Optional[float] = None) -> bool:
+        """
+        等待沙盒内的桌面服务（Xvfb、x11vnc、websockify）启动完成
+        
+        参数:
+            timeout: 最长等待时间（秒），None表示一直等待
+            
+        返回:
+            是否在超时前就绪
+        """
+        if self.ready:
+            return True
+        if not self.ready_marker and self.host_port is None:
+            # 既没有就绪标记也没有映射端口，无从判断
+            self.log.warning("沙盒 %s 未配置就绪标记和端口，跳过就绪检测", self.session_id)
+            return False
+        self.ready = ReadinessWatcher.get_instance().wait(
+            self.container_id,
+            self._get_client(),
+            ready_marker=self.ready_marker,
+            probe_port=self.host_port,
+            probe_host=self.endpoint.host if self.endpoint is not None else "127.0.0.1",
+            timeout=timeout
+        )
+        return self.ready
+    
+    def fork(self, n: int, session_ids: Optional[List[str]] = None,
+             wait_ready: bool = False) -> List['Sandbox']:
+        """
+        将当前沙盒的文件系统提交为镜像，并发启动n个副本
+        
+        提交只进行一次，副本直接复用提交得到的镜像层，启动成本与普通 run 相同，
+        无需重放依赖安装、文件上传等准备步骤。只复制文件系统，容器内运行中的进程不会被复制，
+        副本会重新执行启动脚本。
+        
+        参数:
+            n: 副本数量
+            session_ids: 副本的会话ID列表，默认为 "<当前会话ID>-fork-<随机后缀>"
+            wait_ready: 是否等待副本的桌面服务启动完成 (默认: False)
+            
+        返回:
+            成功启动的副本沙盒列表（与 session_ids 顺序一致，失败的副本不包含在内）
+        """
+        if n <= 0:
+            return []
+        if session_ids is None:
+            session_ids = [f"{self.session_id}-fork-{uuid.uuid4().hex[:8]}" for _ in range(n)]
+        elif len(session_ids) != n:
+            raise ValueError("session_ids 的数量必须与 n 一致")
+        
+        try:
+            self._ensure_available()
+            factory = SandboxFactory.get_instance()
+            container = self._get_client().containers.get(self.container_id)
+            # 提交时默认暂停容器，保证文件系统快照的一致性；
+            # 提交会合并容器自身的标签，清空从准备步骤镜像继承的标签，避免快照被当作缓存镜像
+            image = container.commit(
+                repository="sandbox-fork",
+                tag=uuid.uuid4().hex[:12],
+                conf={"Labels": {
+                    LABEL_FACTORY: factory.config.factory_name,
+                    LABEL_FORK_OF: self.session_id,
+                    LABEL_RECIPE_HASH: "",
+                    LABEL_RECIPE_BASE: "",
+                }}
+            )
+            self.log.info("沙盒 %s 已提交为镜像 %s，开始启动 %s 个副本", self.session_id, image.id, n)
+            # 启动期间持有一个引用，所有副本都启动失败时镜像立即删除
+            factory._retain_fork_image(image.id, self.endpoint)
+        except Exception as e:
+            self.log.error("提交沙盒快照失败: %s", e)
+            return []
+        
+        # 父沙盒映射了端口时，副本由Docker分配空闲的宿主机端口
+        host_port = 0 if self.host_port is not None else None
+        endpoint_name = self.endpoint.name if self.endpoint is not None else None
+        
+        def launch(session_id: str) -> Optional[Sandbox]:
+            return factory.run(session_id, host_port=host_port, wait_ready=wait_ready,
+                               image=image.id, endpoint=endpoint_name)
+        
+        workers = max(1, min(n, factory.config.launch_concurrency))
+        try:
+            with ThreadPoolExecutor(max_workers=workers) as executor:
+                clones = [clone for clone in executor.map(launch, session_ids) if clone is not None]
+        finally:
+            factory._release_fork_image(image.id)
+        self.log.info("沙盒 %s 分叉完成: 成功 %s/%s", self.session_id, len(clones), n)
+        return clones
     
     def upload_file(self, host_path: str, container_path: str) -> bool:
         """
@@ -46,45 +259,97 @@ class Sandbox:
             操作是否成功
         """
         try:
+            self._ensure_available()
+            
             # 检查文件是否存在
             if not os.path.exists(host_path):
-                print(f"错误: 文件 {host_path} 不存在")
+                self.log.error("错误: 文件 %s 不存在", host_path)
                 return False
+            
+            with self._span("sandbox.upload_file", container_path=container_path) as span:
+                # 创建tar文件，直接以打包结果的大小作为上传大小，不再单独遍历目录
+                with span.phase("tar_build"):
+                    tar_data = build_tar(host_path)
+                span.set_attribute("bytes", len(tar_data))
+                self.log.debug("正在将 %s (%d 字节) 上传到容器 %s 的 %s 目录",
+                             host_path, len(tar_data), self.container_id, container_path)
                 
-            # 检查文件大小
-            file_size = os.path.getsize(host_path) if os.path.isfile(host_path) else sum(
-                os.path.getsize(os.path.join(dirpath, filename))
-                for dirpath, _, filenames in os.walk(host_path)
-                for filename in filenames
-            )
-            print(f"上传内容大小: {file_size} 字节")
-            
-            # 创建tar文件
-            tar_stream = io.BytesIO()
-            with tarfile.open(fileobj=tar_stream, mode='w') as tar:
-                # 如果是目录，添加整个目录
-                if os.path.isdir(host_path):
-                    basename = os.path.basename(host_path.rstrip('/'))
-                    tar.add(host_path, arcname=basename)
-                else:
-                    # 如果是文件，直接添加
-                    tar.add(host_path, arcname=os.path.basename(host_path))
-            tar_stream.seek(0)
-            
-            # 获取容器对象
-            client = docker.from_env()
-            container = client.containers.get(self.container_id)
-            
-            # 复制文件到容器
-            print(f"正在将 {host_path} 上传到容器 {self.container_id} 的 {container_path} 目录...")
-            container.put_archive(container_path, tar_stream)
-            print("文件上传成功")
+                # 复制文件到容器
+                with span.phase("api_call"):
+                    self.put_archive(container_path, tar_data)
+            self.log.debug("文件上传成功: %s", host_path)
             return True
             
         except Exception as e:
-            print(f"上传文件时出错: {str(e)}")
+            self.log.error("上传文件时出错: %s", e)
             return False
     
+    def put_archive(self, container_path: str, data: Union[bytes, IO]) -> bool:
+        """
+        将已打包好的tar数据解压到沙盒容器的指定目录
+        
+        参数:
+            container_path: 容器中的目标路径 (目录)
+            data: tar格式的字节数据或可读的流
+            
+        返回:
+            操作是否成功，失败时抛出docker API异常
+        """
+        self._ensure_available()
+        with self._span("sandbox.put_archive", container_path=container_path) as span:
+            with self._slot() as queue_time:
+                span.set_attribute("queue_time", queue_time)
+                container = self._get_client().containers.get(self.container_id)
+                return container.put_archive(container_path, data)
+    
+    def get_archive(self, container_path: str, chunk_size: int = 1 << 20):
+        """
+        以流的形式获取沙盒容器中文件或目录的tar数据，不在内存中整体缓存
+        
+        参数:
+            container_path: 容器中的文件或目录路径
+            chunk_size: 每个数据块的大小（字节）
+            
+        返回:
+            (ArchiveStream, 文件状态字典)，失败时抛出docker API异常；
+            数据读取完毕或调用 close() 时（无论是否开始读取）关闭连接并归还名额
+        """
+        self._ensure_available()
+        # 传输在函数返回后才结束，span不设为当前span，在数据流关闭时结束
+        span = self._span("sandbox.get_archive", container_path=container_path).start()
+        slot = self._slot()
+        try:
+            span.set_attribute("queue_time", slot.__enter__())
+        except BaseException as e:
+            span.end(e)
+            raise
+        
+        def finish(exc: Optional[BaseException] = None) -> None:
+            slot.__exit__(None, None, None)
+            span.end(exc)
+        
+        try:
+            # 直接发起请求以便持有HTTP响应：docker-py 的 get_archive 返回的生成器在未开始迭代时
+            # 无法关闭底层连接
+            api = self._get_client().api
+            response = api._get(api._url('/containers/{0}/archive', self.container_id),
+                                params={'path': container_path}, stream=True,
+                                headers={"Accept-Encoding": "identity"})
+            try:
+                api._raise_for_status(response)
+                # 大文件传输耗时可能超过客户端的读取超时
+                api._disable_socket_timeout(api._get_raw_response_socket(response))
+            except BaseException:
+                response.close()
+                raise
+        except BaseException as e:
+            finish(e)
+            raise
+        
+        encoded_stat = response.headers.get('x-docker-container-path-stat')
+        stat = decode_json_header(encoded_stat) if encoded_stat else None
+        return ArchiveStream(response, chunk_size, finish), stat
+    
     def download_file(self, container_path: str, host_path: str) -> bool:
         """
         从沙盒容器下载文件到宿主机
@@ -99,60 +364,64 @@ class Sandbox:
         try:
             # 确保参数不为空
             if not container_path or not host_path:
-                print(f"错误: 容器路径或宿主机路径不能为空")
+                self.log.error("错误: 容器路径或宿主机路径不能为空")
                 return False
                 
             # 创建目标目录（如果不存在）
             host_dir = os.path.dirname(host_path)
             if host_dir and not os.path.exists(host_dir):
                 os.makedirs(host_dir, exist_ok=True)
-                print(f"已创建目录: {host_dir}")
+                self.log.debug("已创建目录: %s", host_dir)
                 
-            # 获取容器对象
-            client = docker.from_env()
-            container = client.containers.get(self.container_id)
-            
-            # 从容器获取文件
-            print(f"正在从容器 {self.container_id} 的 {container_path} 下载文件...")
-            tar_stream, stat = container.get_archive(container_path)
-            
-            # 将生成器转换为字节流
-            tar_data = b''.join(chunk for chunk in tar_stream)
-            tar_stream = io.BytesIO(tar_data)
-            
-            # 解压文件到宿主机
-            with tarfile.open(fileobj=tar_stream) as tar:
-                dest_dir = os.path.dirname(host_path)
-                members = tar.getmembers()
+            self.log.debug("正在从容器 %s 的 %s 下载文件", self.container_id, container_path)
+            with self._span("sandbox.download_file", container_path=container_path) as span:
+                # 从容器获取文件，将生成器转换为字节流
+                with span.phase("api_call"):
+                    tar_stream, stat = self.get_archive(container_path)
+                    tar_data = b''.join(chunk for chunk in tar_stream)
+                span.set_attribute("bytes", len(tar_data))
                 
-                if len(members) == 1 and not os.path.isdir(host_path):
-                    # 如果只有一个文件且目标不是目录，直接提取到目标路径
-                    member = members[0]
-                    extract_path = dest_dir if dest_dir else "."
-                    member.name = os.path.basename(host_path)
-                    print(f"将 {member.name} 提取到 {extract_path}")
-                    tar.extract(member, path=extract_path)
-                else:
-                    # 否则提取到目标目录
-                    extract_path = host_path if os.path.isdir(host_path) else dest_dir
-                    extract_path = extract_path if extract_path else "."
-                    print(f"将多个文件提取到 {extract_path}")
-                    tar.extractall(path=extract_path)
+                # 解压文件到宿主机
+                with span.phase("extract"):
+                    self._extract_download(io.BytesIO(tar_data), host_path)
                 
-            print(f"文件已成功下载到: {host_path}")
+            self.log.debug("文件已成功下载到: %s", host_path)
             return True
             
         except Exception as e:
-            print(f"下载文件时出错: {str(e)}")
+            self.log.error("下载文件时出错: %s", e)
             return False
     
+    def _extract_download(self, tar_stream: IO[bytes], host_path: str) -> None:
+        """
+        将下载的tar数据解压到宿主机目标路径
+        """
+        with tarfile.open(fileobj=tar_stream) as tar:
+            dest_dir = os.path.dirname(host_path)
+            members = tar.getmembers()
+            
+            if len(members) == 1 and not os.path.isdir(host_path):
+                # 如果只有一个文件且目标不是目录，直接提取到目标路径
+                member = members[0]
+                extract_path = dest_dir if dest_dir else "."
+                member.name = os.path.basename(host_path)
+                self.log.debug("将 %s 提取到 %s", member.name, extract_path)
+                tar.extract(member, path=extract_path)
+            else:
+                # 否则提取到目标目录
+                extract_path = host_path if os.path.isdir(host_path) else dest_dir
+                extract_path = extract_path if extract_path else "."
+                self.log.debug("将多个文件提取到 %s", extract_path)
+                tar.extractall(path=extract_path)
+    
     def exec(self, command: List[str], 
              stdout: Union[int, IO, None] = subprocess.PIPE,
              stderr: Union[int, IO, None] = subprocess.STDOUT,
              shell: bool = False,
              env: Optional[Dict[str, str]] = None,
              cwd: Optional[str] = None,
-             universal_newlines: bool = True) -> subprocess.Popen:
+             universal_newlines: bool = True,
+             bufsize: Optional[int] = None) -> subprocess.Popen:
         """
         在沙盒内执行命令并返回subprocess.Popen对象，以便于流式获取输出
         
@@ -164,6 +433,8 @@ class Sandbox:
             env: 环境变量字典 (默认: None，使用当前环境)
             cwd: 工作目录 (默认: None)
             universal_newlines: 是否使用通用换行符模式 (默认: True)
+            bufsize: 管道缓冲区大小 (默认: 文本模式为1即行缓冲，二进制模式为 EXEC_BUFFER_SIZE；
+                     为0时 stdout 是无缓冲的原始管道，适合配合 readinto 使用)
             
         返回:
             subprocess.Popen对象，可用于流式获取命令输出
@@ -175,8 +446,13 @@ class Sandbox:
             return_code = process.wait()
         """
         try:
-            # 构建完整的docker exec命令
-            docker_cmd = ["docker", "exec"]
+            self._ensure_available()
+            
+            # 构建完整的docker exec命令，远程端点通过 -H 指定守护进程
+            docker_cmd = ["docker"]
+            if self.endpoint is not None and self.endpoint.base_url:
+                docker_cmd.extend(["-H", self.endpoint.base_url])
+            docker_cmd.append("exec")
             
             # 如果指定了环境变量，添加到命令中
             if env:
@@ -202,27 +478,53 @@ class Sandbox:
                 # 直接添加命令和参数
                 docker_cmd.extend(command)
                 
-            print(f"执行命令: {' '.join(docker_cmd)}")
-            
-            # 使用subprocess.Popen执行命令
-            process = subprocess.Popen(
-                docker_cmd,
-                stdout=stdout,
-                stderr=stderr,
-                universal_newlines=universal_newlines,
-                bufsize=1,  # 行缓冲
-                env=os.environ.copy()  # 使用当前环境变量
-            )
+            if self.log.isEnabledFor(logging.DEBUG):
+                # 拼接命令字符串有开销，只在需要输出时进行
+                self.log.debug("执行命令: %s", ' '.join(docker_cmd))
             
+            if bufsize is None:
+                # 文本模式行缓冲；二进制模式使用大缓冲区，减少系统调用次数
+                bufsize = 1 if universal_newlines else EXEC_BUFFER_SIZE
+            
+            # 记录排队和启动进程的耗时；命令本身在后台运行，不计入span
+            with self._span("sandbox.exec", shell=shell) as span:
+                # 占用exec名额，命令结束后归还
+                queue_time = 0.0
+                if self.scheduler is not None:
+                    queue_time = self.scheduler.acquire(self.session_id, self.queue_timeout)
+                span.set_attribute("queue_time", queue_time)
+                
+                # 使用subprocess.Popen执行命令
+                try:
+                    with span.phase("spawn"):
+                        process = subprocess.Popen(
+                            docker_cmd,
+                            stdout=stdout,
+                            stderr=stderr,
+                            universal_newlines=universal_newlines,
+                            bufsize=bufsize,
+                            env=os.environ.copy()  # 使用当前环境变量
+                        )
+                except Exception:
+                    if self.scheduler is not None:
+                        self.scheduler.release(self.session_id)
+                    raise
+            
+            # 记录排队时间，便于调用方观察尾延迟
+            process.queue_time = queue_time
+            self._processes.add(process)
+            if self.scheduler is not None:
+                threading.Thread(target=self._release_on_exit, args=(process,), daemon=True).start()
             return process
             
         except Exception as e:
-            print(f"执行命令时出错: {str(e)}")
+            self.log.error("执行命令时出错: %s", e)
             # 创建一个"失败"的Popen对象，避免返回None
             class FailedPopen:
-                def __init__(self, error_message):
+                def __init__(self, error):
                     self.returncode = 1
-                    self.error_message = error_message
+                    self.error = error  # 导致失败的异常
+                    self.error_message = str(error)
                     self.stdout = open(os.devnull, 'r')  # 一个空的文件对象
                     
                 def wait(self):
@@ -234,7 +536,197 @@ class Sandbox:
                 def communicate(self):
                     return "", self.error_message
             
-            return FailedPopen(str(e))
+            return FailedPopen(e)
+    
+    def exec_to(self, command: List[str], sink: Union[str, IO, Any],
+                shell: bool = False,
+                env: Optional[Dict[str, str]] = None,
+                cwd: Optional[str] = None,
+                chunk_size: int = EXEC_BUFFER_SIZE) -> int:
+        """
+        以二进制模式在沙盒内执行命令，并将标准输出直接写入宿主机文件或套接字
+        
+        输出不经过文本解码和按行切分：
+            - sink 为文件路径，或带有 fileno() 的文件/阻塞套接字时，其文件描述符直接作为 docker 进程的
+              标准输出，数据由内核写入目标，不经过Python进程
+            - 其他带有 write() 的对象（如 BytesIO）通过可复用的缓冲区以 readinto 读取，
+              按 memoryview 切片写入，不产生中间 bytes 对象
+        标准错误写入临时文件，不会混入输出数据，命令失败时打印其末尾内容。
+        
+        参数:
+            command: 要执行的命令及参数列表
+            sink: 宿主机文件路径、带 fileno() 的文件对象或套接字、或带 write() 的对象
+            shell: 是否使用shell执行命令 (默认: False)
+            env: 环境变量字典 (默认: None)
+            cwd: 工作目录 (默认: None)
+            chunk_size: readinto 缓冲区大小（字节）
+            
+        返回:
+            命令退出码
+            
+        用法示例:
+            sandbox.exec_to(["tar", "-C", "/opt", "-cf", "-", "data"], "data.tar")
+        """
+        with tempfile.TemporaryFile() as stderr_file:
+            if isinstance(sink, str):
+                with open(sink, 'wb') as f:
+                    process = self.exec(command, stdout=f, stderr=stderr_file, shell=shell,
+                                        env=env, cwd=cwd, universal_newlines=False, bufsize=0)
+                    return_code = process.wait()
+            else:
+                fileno = None
+                if hasattr(sink, "fileno"):
+                    try:
+                        fileno = sink.fileno()
+                    except (OSError, ValueError):
+                        # 例如 BytesIO 没有真实的文件描述符
+                        fileno = None
+                if fileno is not None:
+                    if hasattr(sink, "flush"):
+                        sink.flush()
+                    process = self.exec(command, stdout=fileno, stderr=stderr_file, shell=shell,
+                                        env=env, cwd=cwd, universal_newlines=False, bufsize=0)
+                    return_code = process.wait()
+                else:
+                    process = self.exec(command, stdout=subprocess.PIPE, stderr=stderr_file, shell=shell,
+                                        env=env, cwd=cwd, universal_newlines=False, bufsize=0)
+                    buffer = bytearray(chunk_size)
+                    view = memoryview(buffer)
+                    try:
+                        readinto = getattr(process.stdout, "readinto", None)
+                        while readinto is not None:
+                            n = readinto(buffer)
+                            if not n:
+                                break
+                            sink.write(view[:n])
+                    finally:
+                        view.release()
+                        process.stdout.close()
+                    return_code = process.wait()
+            
+            if return_code != 0:
+                stderr_file.seek(0)
+                error = stderr_file.read()[-2000:].decode('utf-8', errors='replace')
+                self.log.error("命令执行失败，退出码 %s: %s", return_code, error or getattr(process, 'error_message', ''))
+            return return_code
+    
+    def _ensure_screen_helper(self) -> None:
+        """
+        首次截屏时将采集脚本上传到容器中
+        """
+        if self._screen_helper_ready:
+            return
+        with open(HELPER_HOST_PATH, 'rb') as f:
+            script = f.read()
+        tar_stream = io.BytesIO()
+        with tarfile.open(fileobj=tar_stream, mode='w') as tar:
+            info = tarfile.TarInfo(name=os.path.basename(HELPER_CONTAINER_PATH))
+            info.size = len(script)
+            info.mode = 0o755
+            tar.addfile(info, io.BytesIO(script))
+        self.put_archive(HELPER_CONTAINER_DIR, tar_stream.getvalue())
+        self._screen_helper_ready = True
+    
+    def screen_stream(self, fps: float = 2.0, format: str = "jpeg", quality: int = 70,
+                      delta: bool = True, keyframe_interval: int = 0,
+                      count: int = 0, display: str = ":1") -> Iterator[ScreenFrame]:
+        """
+        持续采集沙盒Xvfb显示器的画面
+        
+        所有帧通过同一个exec进程的二进制输出流返回，每帧只有固定长度的帧头开销。
+        开启增量模式时，第一帧为完整画面，之后只返回变化区域，画面不变时不产生帧。
+        关闭生成器时会终止容器内的采集进程。
+        
+        参数:
+            fps: 采集帧率
+            format: 图像格式，png 或 jpeg (默认: jpeg)
+            quality: JPEG质量 (默认: 70)
+            delta: 是否只返回变化区域 (默认: True)
+            keyframe_interval: 每隔多少次采集强制返回一次完整画面，0表示只在开始时返回
+            count: 返回的帧数，0表示持续返回
+            display: X显示器 (默认: :1，与 start.sh 一致)
+            
+        返回:
+            ScreenFrame 生成器；图像格式不支持时立即抛出 ValueError，采集脚本上传失败时立即抛出docker API异常
+        
+        用法示例:
+            for frame in sandbox.screen_stream(fps=5):
+                canvas.paste(Image.open(io.BytesIO(frame.data)), (frame.x, frame.y))
+        """
+        # 参数检查和脚本上传在返回生成器之前完成，错误在调用时就能发现
+        if format not in ("png", "jpeg"):
+            raise ValueError(f"不支持的图像格式: {format}")
+        self._ensure_screen_helper()
+        command = ["python", HELPER_CONTAINER_PATH,
+                   "--display", display,
+                   "--fps", str(fps),
+                   "--format", format,
+                   "--quality", str(quality),
+                   "--count", str(count),
+                   "--keyframe-interval", str(keyframe_interval)]
+        if delta:
+            command.append("--delta")
+        return self._screen_frames(command, format)
+    
+    def _screen_frames(self, command: List[str], format: str) -> Iterator[ScreenFrame]:
+        """
+        启动采集进程并逐帧返回画面，没有产生任何帧时记录采集脚本的错误输出
+        """
+        # 错误输出写入临时文件而不是管道，采集脚本持续输出警告时不会阻塞
+        with tempfile.TemporaryFile() as errors:
+            process = self.exec(command, stderr=errors, universal_newlines=False)
+            frames = 0
+            try:
+                for frame in read_frames(process.stdout, format):
+                    frames += 1
+                    yield frame
+            finally:
+                killed = process.poll() is None
+                if killed:
+                    process.kill()
+                process.stdout.close()
+                return_code = process.wait()
+                if frames == 0 and not killed:
+                    errors.seek(0)
+                    message = errors.read(4096).decode('utf-8', errors='replace').strip()
+                    self.log.warning("沙盒 %s 的屏幕采集没有返回画面，退出码 %s: %s",
+                                   self.session_id, return_code,
+                                   message or getattr(process, 'error_message', ''))
+    
+    def screenshot(self, format: str = "png", quality: int = 85, display: str = ":1") -> Optional[bytes]:
+        """
+        截取沙盒Xvfb显示器的完整画面
+        
+        参数:
+            format: 图像格式，png 或 jpeg (默认: png)
+            quality: JPEG质量 (默认: 85)
+            display: X显示器 (默认: :1)
+            
+        返回:
+            编码后的图像数据，失败时返回None
+        """
+        try:
+            stream = self.screen_stream(fps=0, format=format, quality=quality,
+                                        delta=False, count=1, display=display)
+            try:
+                frame = next(stream, None)
+            finally:
+                stream.close()
+            if frame is not None:
+                return frame.data
+            self.log.error("截屏失败: 沙盒 %s 没有返回画面", self.session_id)
+        except Exception as e:
+            self.log.error("截屏时出错: %s", e)
+        return None
+    
+    def _release_on_exit(self, process: subprocess.Popen) -> None:
+        """
+        等待命令结束后归还exec名额
+        """
+        try:
+            process.wait()
+        finally:
+            self.scheduler.release(self.session_id)
 
 class SandboxFactory:
     """
@@ -250,9 +742,9 @@ class SandboxFactory:
                 if cls._instance is None:
                     try:
                         cls._instance = super().__new__(cls)
-                        print("成功创建 SandboxFactory 实例")
+                        logger.info("成功创建 SandboxFactory 实例")
                     except Exception as e:
-                        print(f"创建 SandboxFactory 实例时出错: {str(e)}")
+                        logger.error("创建 SandboxFactory 实例时出错: %s", e)
                         raise
         return cls._instance
     
@@ -267,98 +759,315 @@ class SandboxFactory:
         try:
             with self._lock:
                 if not hasattr(self, 'initialized') or not self.initialized:
-                    print("初始化 SandboxFactory...")
+                    logger.info("初始化 SandboxFactory...")
                     self.config = config
-                    self.client = docker.from_env()
+                    if config.trace_file or config.trace_collector_url:
+                        configure_tracing(config.trace_file, config.trace_collector_url)
+                    # 端点名称 -> Docker端点，未配置端点时只使用环境变量指定的守护进程
+                    self.endpoints: Dict[str, DockerEndpoint] = {}
+                    for endpoint_config in (config.endpoints or [EndpointConfig()]):
+                        if endpoint_config.name in self.endpoints:
+                            raise ValueError(f"端点名称重复: {endpoint_config.name}")
+                        self.endpoints[endpoint_config.name] = DockerEndpoint(
+                            endpoint_config, max_pool_size=config.docker_pool_size)
+                    # 默认客户端，即第一个端点的客户端
+                    self.client = next(iter(self.endpoints.values())).client
                     self.sandboxes: Dict[str, Sandbox] = {}  # session_id -> Sandbox
+                    self._containers: Dict[str, Sandbox] = {}  # container_id -> Sandbox
+                    self._pending: Dict[str, threading.Event] = {}  # 正在创建的 session_id
                     self._sandbox_lock = threading.RLock()  # 使用可重入锁
-                    self._initialize_image()
+                    # 状态变化回调: (沙盒, 旧状态, 新状态)
+                    self._state_listeners: List[Callable[[Sandbox, str, str], None]] = []
+                    # 内容哈希 -> tar数据，用于批量上传时复用已打包的归档
+                    self._archive_cache: "OrderedDict[str, bytes]" = OrderedDict()
+                    self._archive_cache_bytes = 0
+                    # 分叉快照镜像ID -> [所在端点, 引用计数]，引用来自使用该镜像的副本和进行中的分叉
+                    self._fork_images: Dict[str, List[Any]] = {}
+                    self._archive_lock = threading.Lock()
+                    # exec和文件传输的全局/会话并发限制
+                    self.scheduler = FairScheduler(
+                        global_limit=config.exec_global_limit,
+                        session_limit=config.exec_session_limit
+                    )
+                    # 准备步骤镜像缓存
+                    self._image_cache = RecipeImageCache(
+                        {LABEL_FACTORY: config.factory_name},
+                        budget=config.image_cache_budget
+                    )
+                    for endpoint in self.endpoints.values():
+                        self._initialize_image(endpoint)
+                        self._start_event_watcher(endpoint)
+                    # 垃圾回收：过期沙盒、孤儿容器和无用的快照镜像
+                    self._collector = SandboxCollector(
+                        self,
+                        interval=config.gc_interval,
+                        idle_ttl=config.idle_ttl,
+                        max_lifetime=config.max_lifetime,
+                        orphan_grace=config.orphan_grace,
+                        concurrency=config.gc_concurrency
+                    )
+                    self._collector.start()
                     self.initialized = True
-                    print("SandboxFactory 初始化完成")
+                    logger.info("SandboxFactory 初始化完成")
         except Exception as e:
-            print(f"初始化 SandboxFactory 时出错: {str(e)}")
+            logger.error("初始化 SandboxFactory 时出错: %s", e)
             raise
     
-    def _initialize_image(self):
+    def _initialize_image(self, endpoint: DockerEndpoint):
         """
         初始化Docker镜像
+        
+        参数:
+            endpoint: 需要准备镜像的Docker端点
         """
         try:
             image_name = f"{self.config.image_name}:{self.config.image_tag}"
-            self.client.images.get(image_name)
-            print(f"镜像 {image_name} 已存在")
+            endpoint.client.images.get(image_name)
+            logger.debug("镜像 %s 已存在 (端点: %s)", image_name, endpoint.name, extra={"endpoint": endpoint.name})
         except docker.errors.ImageNotFound:
-            print(f"镜像 {image_name} 不存在，正在拉取...")
-            self.client.images.pull(image_name)
-            print("镜像拉取完成")
+            logger.info("镜像 %s 不存在，正在拉取 (端点: %s)...", image_name, endpoint.name, extra={"endpoint": endpoint.name})
+            endpoint.client.images.pull(image_name)
+            logger.info("镜像拉取完成", extra={"endpoint": endpoint.name})
         except Exception as e:
-            print(f"初始化镜像时出错: {str(e)}")
+            logger.error("初始化镜像时出错: %s", e, extra={"endpoint": endpoint.name})
             raise
     
-    def run(self, session_id: str, host_port: Optional[int] = None) -> Optional[Sandbox]:
+    def _start_event_watcher(self, endpoint: DockerEndpoint):
+        """
+        为端点启动Docker事件监听
+        """
+        endpoint.event_watcher = ContainerEventWatcher(
+            endpoint.client,
+            [f"{LABEL_FACTORY}={self.config.factory_name}"],
+            on_event=self._handle_container_event,
+            on_resync=lambda: self._resync_states(endpoint)
+        )
+        endpoint.event_watcher.start()
+    
+    def run(self, session_id: str, host_port: Optional[int] = None,
+            wait_ready: bool = False, ready_timeout: Optional[float] = None,
+            image: Optional[str] = None, endpoint: Optional[str] = None) -> Optional[Sandbox]:
         """
         创建并启动一个新的沙盒
         
         参数:
             session_id: 会话ID，用于唯一标识沙盒
-            host_port: 宿主机端口，用于映射容器的VNC端口 (5900)，如果为None则不进行端口映射
+            host_port: 宿主机端口，用于映射容器的VNC端口 (5900)，如果为None则不进行端口映射，为0时由Docker分配空闲端口
+            wait_ready: 是否等待沙盒内的桌面服务启动完成后再返回 (默认: False)
+            ready_timeout: 等待就绪的超时时间（秒），默认使用 config.ready_timeout
+            image: 使用的镜像，默认为配置中的 image_name:image_tag
+            endpoint: 指定放置的端点名称，默认按放置策略选择
             
         返回:
-            Sandbox对象，如果创建失败则返回None
+            Sandbox对象，如果创建失败则返回None；等待就绪超时时仍返回沙盒，其ready属性为False
+        """
+        tracer = get_tracer()
+        with tracer.span("factory.run", session_id=session_id) as span:
+            sandbox = self._create_sandbox(session_id, host_port, image, endpoint)
+            span.set_attribute("created", sandbox is not None)
+            if sandbox is not None and wait_ready:
+                # 在工厂锁之外等待，避免阻塞其他会话的创建
+                timeout = ready_timeout if ready_timeout is not None else self.config.ready_timeout
+                with tracer.span("wait_ready"):
+                    ready = sandbox.wait_ready(timeout)
+                span.set_attribute("ready", ready)
+                if ready:
+                    sandbox.log.info("沙盒已就绪: session_id=%s", session_id)
+                else:
+                    sandbox.log.warning("等待沙盒就绪超时: session_id=%s", session_id)
+        return sandbox
+    
+    def _create_sandbox(self, session_id: str, host_port: Optional[int] = None,
+                        image: Optional[str] = None, endpoint_name: Optional[str] = None) -> Optional[Sandbox]:
+        """
+        选择端点并创建容器，返回对应的沙盒对象
+        
+        工厂锁只用于登记会话和选择端点，容器创建在锁外进行，不同会话可以并发创建。
         """
         try:
-            with self._sandbox_lock:
+            placement = get_tracer().span("placement")
+            with placement, self._sandbox_lock:
                 # 检查是否已存在相同session_id的沙盒
                 if session_id in self.sandboxes:
-                    print(f"会话 {session_id} 已存在沙盒")
+                    logger.debug("会话 %s 已存在沙盒", session_id, extra={"session_id": session_id})
                     return self.sandboxes[session_id]
                 
-                try:
-                    # 准备端口映射配置
-                    ports = {}
-                    if host_port is not None:
-                        # 将容器的VNC端口映射到宿主机指定端口
-                        container_port = self.config.vnc_port
-                        ports = {f"{container_port}/tcp": host_port}
-                        print(f"设置端口映射: 容器端口 {container_port} -> 宿主机端口 {host_port}")
-                    
-                    # 创建容器
-                    container = self.client.containers.run(
+                pending = self._pending.get(session_id)
+                if pending is None:
+                    if endpoint_name is not None:
+                        endpoint = self.endpoints.get(endpoint_name)
+                        if endpoint is not None and not endpoint.has_room():
+                            endpoint = None
+                    else:
+                        endpoint = select_endpoint(list(self.endpoints.values()), self.config.placement)
+                    if endpoint is None:
+                        logger.error("创建沙盒失败: 没有可用的Docker端点 (session_id=%s)", session_id,
+                                     extra={"session_id": session_id})
+                        return None
+                    endpoint.acquire()
+                    self._pending[session_id] = threading.Event()
+            
+            if pending is not None:
+                # 同一会话正在由其他线程创建，等待其完成
+                pending.wait()
+                return self.sandboxes.get(session_id)
+            current_span().set_attribute("endpoint", endpoint.name)
+            
+            try:
+                return self._start_container(endpoint, session_id, host_port, image)
+            finally:
+                with self._sandbox_lock:
+                    self._pending.pop(session_id).set()
+        except Exception as e:
+            logger.error("运行沙盒时发生未预期的错误: %s", e, extra={"session_id": session_id})
+            return None
+    
+    def _start_container(self, endpoint: DockerEndpoint, session_id: str,
+                         host_port: Optional[int] = None, image: Optional[str] = None) -> Optional[Sandbox]:
+        """
+        在指定端点上启动容器并登记沙盒，调用前已为该端点占用一个名额
+        """
+        try:
+            # 准备端口映射配置
+            ports = {}
+            if host_port is not None:
+                # 将容器的VNC端口映射到宿主机指定端口
+                container_port = self.config.vnc_port
+                ports = {f"{container_port}/tcp": host_port or None}
+                logger.info("设置端口映射: 容器端口 %s -> 宿主机端口 %s", container_port, host_port, extra={"session_id": session_id})
+            
+            # 配置了准备步骤时使用缓存的准备镜像，命中时跳过全部准备步骤
+            tracer = get_tracer()
+            if image is None and self.config.setup_recipe is not None:
+                with tracer.span("recipe_image"):
+                    image = self._image_cache.get_or_build(
+                        endpoint,
                         f"{self.config.image_name}:{self.config.image_tag}",
-                        working_dir=self.config.working_dir,
-                        detach=True,
-                        mem_limit=self.config.mem_limit,
-                        cpu_period=self.config.cpu_period,
-                        cpu_quota=self.config.cpu_quota,
-                        network_disabled=False if host_port else self.config.network_disabled,  # 如果映射端口，需要启用网络
-                        privileged=self.config.privileged,
-                        environment=self.config.environment,
-                        ports=ports  # 添加端口映射
+                        self.config.setup_recipe,
+                        self.config.working_dir,
+                        self.config.environment
                     )
-                    
-                    # 创建沙盒对象
-                    sandbox = Sandbox(container.id, session_id, host_port)
-                    self.sandboxes[session_id] = sandbox
-                    print(f"创建沙盒成功: session_id={session_id}, container_id={container.id}" + 
-                        (f", 端口映射: {self.config.vnc_port} -> {host_port}" if host_port else ""))
-                    return sandbox
-                    
-                except Exception as e:
-                    print(f"创建沙盒失败: {str(e)}")
-                    # 尝试清理可能部分创建的容器
-                    try:
-                        containers = self.client.containers.list(all=True)
-                        for container in containers:
-                            if session_id in container.name:
-                                print(f"清理部分创建的容器: {container.id}")
-                                container.remove(force=True)
-                    except Exception as cleanup_error:
-                        print(f"清理容器时出错: {str(cleanup_error)}")
-                    return None
+            
+            # 创建容器
+            with tracer.span("container_create"):
+                container = endpoint.client.containers.run(
+                    image or f"{self.config.image_name}:{self.config.image_tag}",
+                    working_dir=self.config.working_dir,
+                    detach=True,
+                    mem_limit=self.config.mem_limit,
+                    cpu_period=self.config.cpu_period,
+                    cpu_quota=self.config.cpu_quota,
+                    network_disabled=False if host_port is not None else self.config.network_disabled,  # 如果映射端口，需要启用网络
+                    privileged=self.config.privileged,
+                    environment=self.config.environment,
+                    ports=ports,  # 添加端口映射
+                    labels={
+                        LABEL_FACTORY: self.config.factory_name,
+                        LABEL_SESSION: session_id,
+                    }
+                )
+            current_span().set_attribute("container_id", container.id)
+            
+            if host_port == 0:
+                # 读取Docker分配的宿主机端口
+                container.reload()
+                bindings = container.attrs["NetworkSettings"]["Ports"].get(f"{self.config.vnc_port}/tcp") or []
+                host_port = int(bindings[0]["HostPort"]) if bindings else None
+            
+            # 创建沙盒对象
+            sandbox = Sandbox(container.id, session_id, host_port, endpoint=endpoint,
+                              ready_marker=self.config.ready_marker,
+                              # 未配置并发限制时不经过调度器，exec不再需要等待进程结束归还名额的线程
+                              scheduler=self.scheduler if self.scheduler.limited else None,
+                              queue_timeout=self.config.exec_queue_timeout)
+            with self._sandbox_lock:
+                self.sandboxes[session_id] = sandbox
+                self._containers[container.id] = sandbox
+                if image in self._fork_images:
+                    # 分叉副本持有快照镜像的引用
+                    self._fork_images[image][1] += 1
+                    sandbox.fork_image = image
+            # 登记之前到达的事件会因容器未知而被丢弃（例如启动脚本立即退出或启动时OOM），
+            # 登记后再查询一次实际状态
+            try:
+                container.reload()
+                self._reconcile_state(sandbox, container)
+            except NotFound:
+                self._set_state(sandbox, "removed")
+            except Exception as e:
+                # 沙盒已登记，校正失败时不影响创建结果，之后的事件仍会更新状态
+                sandbox.log.warning("校正沙盒 %s 的状态失败: %s", session_id, e)
+            sandbox.log.info("创建沙盒成功: session_id=%s, container_id=%s, 端点: %s, 端口映射: %s, 镜像: %s",
+                        session_id, container.id, endpoint.name, host_port, image)
+            return sandbox
+            
         except Exception as e:
-            print(f"运行沙盒时发生未预期的错误: {str(e)}")
+            logger.error("创建沙盒失败: %s", e, extra={"session_id": session_id})
+            endpoint.release()
+            # 尝试清理可能部分创建的容器
+            try:
+                containers = endpoint.client.containers.list(all=True, filters={
+                    "label": [f"{LABEL_FACTORY}={self.config.factory_name}",
+                              f"{LABEL_SESSION}={session_id}"]
+                })
+                for container in containers:
+                    if container.id not in self._containers:
+                        logger.info("清理部分创建的容器: %s", container.id, extra={"session_id": session_id})
+                        container.remove(force=True)
+            except Exception as cleanup_error:
+                logger.error("清理容器时出错: %s", cleanup_error, extra={"session_id": session_id})
             return None
     
+    def _unregister(self, sandbox: Sandbox) -> None:
+        """
+        从注册表中移除沙盒并释放其端点名额，重复调用无副作用
+        """
+        with self._sandbox_lock:
+            if self._containers.pop(sandbox.container_id, None) is None:
+                return
+            if self.sandboxes.get(sandbox.session_id) is sandbox:
+                del self.sandboxes[sandbox.session_id]
+        self.scheduler.forget(sandbox.session_id)
+        # 停止仍在进行的就绪检测，避免对已删除的容器持续探测
+        ReadinessWatcher.get_instance().cancel(sandbox.container_id)
+        if sandbox.fork_image is not None:
+            self._release_fork_image(sandbox.fork_image)
+        if sandbox.endpoint is not None:
+            sandbox.endpoint.release()
+    
+    def _retain_fork_image(self, image_id: str, endpoint: Optional[DockerEndpoint]) -> None:
+        """
+        增加分叉快照镜像的引用计数
+        """
+        with self._sandbox_lock:
+            self._fork_images.setdefault(image_id, [endpoint, 0])[1] += 1
+    
+    def _release_fork_image(self, image_id: str) -> None:
+        """
+        减少分叉快照镜像的引用计数，最后一个引用释放后在后台删除镜像
+        """
+        with self._sandbox_lock:
+            entry = self._fork_images.get(image_id)
+            if entry is None:
+                return
+            entry[1] -= 1
+            if entry[1] > 0:
+                return
+            del self._fork_images[image_id]
+        client = entry[0].client if entry[0] is not None else self.client
+        # 调用方可能持有工厂锁，删除镜像较慢，放到后台线程中进行
+        threading.Thread(target=self._remove_fork_image, args=(client, image_id), daemon=True).start()
+    
+    def _remove_fork_image(self, client: docker.DockerClient, image_id: str) -> None:
+        try:
+            client.images.remove(image_id)
+            logger.info("已删除分叉快照镜像 %s", image_id)
+        except NotFound:
+            pass
+        except Exception as e:
+            # 例如镜像仍被容器使用或已有子镜像（副本再次分叉），留给垃圾回收处理
+            logger.warning("删除分叉快照镜像 %s 失败: %s", image_id, e)
+    
     def remove(self, session_id: str) -> bool:
         """
         删除指定的沙盒
@@ -371,16 +1080,255 @@ class SandboxFactory:
         """
         try:
             with self._sandbox_lock:
-                if session_id in self.sandboxes:
-                    sandbox = self.sandboxes[session_id]
-                    if sandbox.remove():
-                        del self.sandboxes[session_id]
-                        return True
+                sandbox = self.sandboxes.get(session_id)
+            if sandbox is None:
                 return False
+            # 停止容器较慢，在工厂锁之外进行，不阻塞其他会话；
+            # 删除成功后由 _set_state 更新状态并从注册表中移除
+            return sandbox.remove()
         except Exception as e:
-            print(f"删除沙盒时出错: {str(e)}")
+            logger.error("删除沙盒时出错: %s", e)
             return False
     
+    def _get_archive(self, host_path: str) -> bytes:
+        """
+        按内容哈希获取tar数据，命中缓存时不再重复打包
+        
+        参数:
+            host_path: 宿主机上的文件或目录路径
+            
+        返回:
+            tar格式的字节数据
+        """
+        key = content_hash(host_path)
+        with self._archive_lock:
+            if key in self._archive_cache:
+                self._archive_cache.move_to_end(key)
+                return self._archive_cache[key]
+        
+        tar_data = build_tar(host_path)
+        if len(tar_data) > self.config.archive_cache_bytes:
+            # 大归档只用于本次上传，不占用缓存
+            return tar_data
+        with self._archive_lock:
+            if key not in self._archive_cache:
+                self._archive_cache[key] = tar_data
+                self._archive_cache_bytes += len(tar_data)
+            self._archive_cache.move_to_end(key)
+            while (len(self._archive_cache) > max(self.config.archive_cache_size, 1) or
+                   self._archive_cache_bytes > self.config.archive_cache_bytes):
+                _, evicted = self._archive_cache.popitem(last=False)
+                self._archive_cache_bytes -= len(evicted)
+        return tar_data
+    
+    def broadcast_upload(self, host_path: str, container_path: str,
+                         sandboxes: List[Sandbox],
+                         max_workers: Optional[int] = None) -> Dict[str, Dict[str, Any]]:
+        """
+        将同一份文件或目录并行上传到多个沙盒，归档只打包一次
+        
+        参数:
+            host_path: 宿主机上的文件或目录路径
+            container_path: 容器中的目标路径 (目录)
+            sandboxes: 目标沙盒列表
+            max_workers: 最大并发上传数 (默认: config.upload_concurrency)
+            
+        返回:
+            session_id -> {"success": 是否成功, "latency": 耗时(秒), "error": 错误信息或None}
+        """
+        report: Dict[str, Dict[str, Any]] = {}
+        if not os.path.exists(host_path):
+            logger.error("错误: 文件 %s 不存在", host_path)
+            for sandbox in sandboxes:
+                report[sandbox.session_id] = {"success": False, "latency": 0.0,
+                                              "error": f"文件 {host_path} 不存在"}
+            return report
+        
+        try:
+            tar_data = self._get_archive(host_path)
+        except Exception as e:
+            logger.error("打包上传内容时出错: %s", e)
+            for sandbox in sandboxes:
+                report[sandbox.session_id] = {"success": False, "latency": 0.0, "error": str(e)}
+            return report
+        logger.info("广播上传 %s (%s 字节) 到 %s 个沙盒的 %s 目录...", host_path, len(tar_data), len(sandboxes), container_path)
+        
+        def upload_one(sandbox: Sandbox) -> Dict[str, Any]:
+            start = time.monotonic()
+            try:
+                success = bool(sandbox.put_archive(container_path, tar_data))
+                error = None if success else "put_archive 返回失败"
+            except Exception as e:
+                success = False
+                error = str(e)
+            return {"success": success, "latency": time.monotonic() - start, "error": error}
+        
+        workers = max(1, min(max_workers or self.config.upload_concurrency, len(sandboxes) or 1))
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            results = executor.map(upload_one, sandboxes)
+            for sandbox, result in zip(sandboxes, results):
+                report[sandbox.session_id] = result
+        
+        succeeded = sum(1 for result in report.values() if result["success"])
+        logger.info("广播上传完成: 成功 %s/%s", succeeded, len(sandboxes))
+        return report
+    
+    def status(self, session_id: str) -> Optional[str]:
+        """
+        获取沙盒当前状态，直接读取事件监听器维护的状态，不调用Docker API
+        
+        参数:
+            session_id: 会话ID
+            
+        返回:
+            running / paused / exited / oom / removed，沙盒不存在时返回None
+        """
+        sandbox = self.sandboxes.get(session_id)
+        return sandbox.state if sandbox is not None else None
+    
+    def add_state_listener(self, callback: Callable[[Sandbox, str, str], None]) -> None:
+        """
+        注册沙盒状态变化回调
+        
+        参数:
+            callback: 回调函数，参数为 (沙盒, 旧状态, 新状态)，在事件监听线程中调用，应尽快返回
+        """
+        with self._sandbox_lock:
+            self._state_listeners.append(callback)
+    
+    def remove_state_listener(self, callback: Callable[[Sandbox, str, str], None]) -> None:
+        """
+        注销沙盒状态变化回调
+        """
+        with self._sandbox_lock:
+            if callback in self._state_listeners:
+                self._state_listeners.remove(callback)
+    
+    def _set_state(self, sandbox: Sandbox, state: str, exit_code: Optional[int] = None) -> None:
+        """
+        更新沙盒状态并通知回调，状态被删除的沙盒会从注册表中移除
+        """
+        with self._sandbox_lock:
+            old_state = sandbox.state
+            # OOM之后紧跟的die事件不覆盖oom状态
+            if old_state == state or (old_state == "oom" and state == "exited"):
+                if exit_code is not None:
+                    sandbox.exit_code = exit_code
+                return
+            sandbox.state = state
+            if exit_code is not None:
+                sandbox.exit_code = exit_code
+            if state == "removed":
+                self._unregister(sandbox)
+            listeners = list(self._state_listeners)
+        
+        sandbox.log.info("沙盒状态变化: session_id=%s, %s -> %s", sandbox.session_id, old_state, state)
+        for callback in listeners:
+            try:
+                callback(sandbox, old_state, state)
+            except Exception as e:
+                sandbox.log.error("状态回调执行出错: %s", e)
+    
+    def _handle_container_event(self, container_id: str, action: str, attributes: Dict[str, Any]) -> None:
+        """
+        处理事件监听器推送的容器事件
+        """
+        sandbox = self._containers.get(container_id)
+        if sandbox is None:
+            return
+        exit_code = attributes.get("exitCode")
+        self._set_state(sandbox, EVENT_STATES[action],
+                        int(exit_code) if exit_code is not None else None)
+    
+    def _resync_states(self, endpoint: DockerEndpoint) -> None:
+        """
+        事件流（重新）连接后，通过一次列表查询校正该端点上所有沙盒的状态
+        """
+        containers = endpoint.client.containers.list(all=True, filters={
+            "label": f"{LABEL_FACTORY}={self.config.factory_name}"
+        })
+        existing = {}
+        for container in containers:
+            existing[container.id] = container
+        with self._sandbox_lock:
+            tracked = [sandbox for sandbox in self._containers.values() if sandbox.endpoint is endpoint]
+        for sandbox in tracked:
+            container = existing.get(sandbox.container_id)
+            if container is None:
+                self._set_state(sandbox, "removed")
+            else:
+                self._reconcile_state(sandbox, container)
+    
+    def _reconcile_state(self, sandbox: Sandbox, container) -> None:
+        """
+        按容器的实际状态校正沙盒状态
+        
+        列表查询返回的 State 只是状态字符串，不含OOM标志和退出码，容器已停止时再查询一次详情
+        """
+        state = container.attrs.get("State")
+        if not isinstance(state, dict):
+            if container.status in ("running", "paused"):
+                self._set_state(sandbox, container.status)
+                return
+            container.reload()
+            state = container.attrs.get("State") or {}
+        if state.get("OOMKilled"):
+            self._set_state(sandbox, "oom")
+        elif container.status in ("running", "paused"):
+            self._set_state(sandbox, container.status)
+        elif container.status in ("exited", "dead"):
+            self._set_state(sandbox, "exited", state.get("ExitCode"))
+    
+    def drain_endpoint(self, name: str, timeout: Optional[float] = None,
+                       remove_sandboxes: bool = False) -> bool:
+        """
+        排空指定端点：不再向其放置新沙盒，等待其上的沙盒全部删除后关闭该端点
+        
+        参数:
+            name: 端点名称
+            timeout: 最长等待时间（秒），None表示一直等待
+            remove_sandboxes: 是否主动删除该端点上的现有沙盒 (默认: False，等待会话自行结束)
+            
+        返回:
+            端点是否已清空并关闭；超时时端点保持排空状态，可再次调用
+        """
+        with self._sandbox_lock:
+            endpoint = self.endpoints.get(name)
+            if endpoint is None:
+                logger.warning("端点 %s 不存在", name)
+                return False
+            if len(self.endpoints) == 1:
+                logger.warning("端点 %s 是唯一的端点，不能排空", name)
+                return False
+            endpoint.draining = True
+            sandboxes = [sandbox for sandbox in self.sandboxes.values() if sandbox.endpoint is endpoint]
+        logger.info("开始排空端点 %s，剩余沙盒: %s", name, len(sandboxes), extra={"endpoint": name})
+        
+        if remove_sandboxes and sandboxes:
+            with ThreadPoolExecutor(max_workers=max(1, min(self.config.upload_concurrency, len(sandboxes)))) as executor:
+                list(executor.map(lambda sandbox: self.remove(sandbox.session_id), sandboxes))
+        
+        if not endpoint.wait_empty(timeout):
+            logger.warning("排空端点 %s 超时，剩余沙盒: %s", name, endpoint.active, extra={"endpoint": name})
+            return False
+        
+        with self._sandbox_lock:
+            self.endpoints.pop(name, None)
+            if self.client is endpoint.client:
+                self.client = next(iter(self.endpoints.values())).client
+        endpoint.close()
+        logger.info("端点 %s 已排空并关闭", name, extra={"endpoint": name})
+        return True
+    
+    def collect_garbage(self) -> Dict[str, Any]:
+        """
+        立即执行一次垃圾回收
+        
+        返回:
+            回收报告，见 SandboxCollector.collect
+        """
+        return self._collector.collect()
+    
     def list(self) -> List[Sandbox]:
         """
         获取所有沙盒列表
@@ -392,7 +1340,7 @@ class SandboxFactory:
             with self._sandbox_lock:
                 return list(self.sandboxes.values())
         except Exception as e:
-            print(f"列出沙盒时出错: {str(e)}")
+            logger.error("列出沙盒时出错: %s", e)
             return []
     
     @classmethod
@@ -413,5 +1361,5 @@ class SandboxFactory:
                 raise ValueError("首次创建实例时必须提供配置对象")
             return cls._instance
         except Exception as e:
-            print(f"获取 SandboxFactory 实例时出错: {str(e)}")
+            logger.error("获取 SandboxFactory 实例时出错: %s", e)
             raise 
\ No newline at end of file
@@ -1,3 +1,4 @@
+import logging
 import time
 import uuid
 import socket
@@ -365,4 +366,5 @@ def main():
         sys.exit(1)
 
 if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(name)s: %(message)s")
     main() 
\ No newline at end of file
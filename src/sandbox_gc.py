@@ -0,0 +1,250 @@
+import logging
+import threading
+import time
+from calendar import timegm
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, List, Optional, Tuple
+
+import docker
+
+from labels import LABEL_FACTORY, LABEL_FORK_OF, LABEL_SESSION
+
+logger = logging.getLogger(__name__)
+
+
+def _parse_created(created: str) -> float:
+    """
+    解析Docker返回的创建时间（RFC3339，可能带纳秒），返回Unix时间戳
+    """
+    try:
+        return float(timegm(time.strptime(created[:19], "%Y-%m-%dT%H:%M:%S")))
+    except (TypeError, ValueError):
+        return 0.0
+
+
+def _container_resources(container) -> Dict[str, float]:
+    """
+    读取容器的资源限制和当前内存占用
+    """
+    host_config = container.attrs.get("HostConfig", {})
+    if host_config.get("NanoCpus"):
+        cpus = host_config["NanoCpus"] / 1e9
+    elif host_config.get("CpuQuota") and host_config.get("CpuPeriod"):
+        cpus = host_config["CpuQuota"] / host_config["CpuPeriod"]
+    else:
+        cpus = 0.0
+
+    memory_usage = 0
+    if container.status == "running":
+        try:
+            try:
+                stats = container.stats(stream=False, one_shot=True)
+            except TypeError:
+                # 旧版本docker库不支持one_shot
+                stats = container.stats(stream=False)
+            memory_usage = stats.get("memory_stats", {}).get("usage", 0) or 0
+        except Exception:
+            pass
+
+    return {
+        "cpus": cpus,
+        "memory_limit": host_config.get("Memory") or 0,
+        "memory_usage": memory_usage,
+    }
+
+
+class SandboxCollector:
+    """
+    沙盒垃圾回收器
+
+    周期性地回收三类资源，并按批次并行删除:
+        1. 空闲时间超过 idle_ttl 或存活时间超过 max_lifetime 的沙盒
+        2. 带有本工厂标签但不在 factory.sandboxes 中的孤儿容器（例如编排进程崩溃后遗留的容器）
+        3. 不再被任何容器使用的分叉快照镜像
+    """
+    def __init__(self, factory, interval: Optional[float] = None,
+                 idle_ttl: Optional[float] = None, max_lifetime: Optional[float] = None,
+                 orphan_grace: float = 60.0, concurrency: int = 8):
+        """
+        参数:
+            factory: 所属的 SandboxFactory
+            interval: 回收周期（秒），None表示不启动后台线程，只能手动调用 collect
+            idle_ttl: 沙盒最长空闲时间（秒），None表示不限制
+            max_lifetime: 沙盒最长存活时间（秒），None表示不限制
+            orphan_grace: 新创建容器的保护期（秒），避免误删正在登记的容器
+            concurrency: 并行删除的最大数量
+        """
+        self.factory = factory
+        self.interval = interval
+        self.idle_ttl = idle_ttl
+        self.max_lifetime = max_lifetime
+        self.orphan_grace = orphan_grace
+        self.concurrency = concurrency
+        self._stopped = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._collect_lock = threading.Lock()
+
+    def start(self) -> None:
+        """
+        启动后台回收线程
+        """
+        if self.interval is None or (self._thread is not None and self._thread.is_alive()):
+            return
+        self._stopped.clear()
+        self._thread = threading.Thread(target=self._loop, name="sandbox-gc", daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        """
+        停止后台回收线程
+        """
+        self._stopped.set()
+
+    def _loop(self) -> None:
+        while not self._stopped.wait(self.interval):
+            try:
+                self.collect()
+            except Exception as e:
+                logger.error("沙盒垃圾回收出错: %s", e)
+
+    def collect(self) -> Dict[str, Any]:
+        """
+        执行一次回收
+
+        返回:
+            回收报告，包含删除的沙盒、孤儿容器、镜像，删除失败的容器，
+            以及释放的CPU核数、内存限额和内存占用（字节）
+        """
+        with self._collect_lock:
+            started = time.monotonic()
+            expired = self._find_expired()
+            orphans = self._find_orphans()
+
+            report: Dict[str, Any] = {
+                "expired": [],
+                "orphans": [],
+                "failed": [],
+                "images": [],
+                "cpus": 0.0,
+                "memory_limit": 0,
+                "memory_usage": 0,
+            }
+            tasks = [("expired", endpoint, container_id, sandbox)
+                     for endpoint, container_id, sandbox in expired]
+            tasks += [("orphans", endpoint, container_id, None)
+                      for endpoint, container_id in orphans]
+
+            if tasks:
+                workers = max(1, min(self.concurrency, len(tasks)))
+                with ThreadPoolExecutor(max_workers=workers) as executor:
+                    for kind, name, resources, error in executor.map(lambda task: self._reclaim(*task), tasks):
+                        if error is not None:
+                            report["failed"].append({"id": name, "error": error})
+                            continue
+                        report[kind].append(name)
+                        report["cpus"] += resources["cpus"]
+                        report["memory_limit"] += resources["memory_limit"]
+                        report["memory_usage"] += resources["memory_usage"]
+
+            report["images"] = self._prune_fork_images()
+            report["duration"] = time.monotonic() - started
+
+            if tasks or report["images"]:
+                logger.info("垃圾回收完成: 过期沙盒 %d 个，孤儿容器 %d 个，快照镜像 %d 个，失败 %d 个，"
+                            "释放CPU %.2f 核，内存限额 %d 字节，内存占用 %d 字节",
+                            len(report["expired"]), len(report["orphans"]), len(report["images"]),
+                            len(report["failed"]), report["cpus"], report["memory_limit"],
+                            report["memory_usage"])
+            return report
+
+    def _find_expired(self) -> List[Tuple[Any, str, Any]]:
+        if self.idle_ttl is None and self.max_lifetime is None:
+            return []
+        now = time.time()
+        expired = []
+        for sandbox in self.factory.list():
+            if (self.idle_ttl is not None and now - sandbox.last_active > self.idle_ttl
+                    and not sandbox.in_use()):
+                # 长时间运行的exec、屏幕流或传输中的沙盒不算空闲
+                expired.append((sandbox.endpoint, sandbox.container_id, sandbox))
+            elif self.max_lifetime is not None and now - sandbox.created_at > self.max_lifetime:
+                expired.append((sandbox.endpoint, sandbox.container_id, sandbox))
+        return expired
+
+    def _find_orphans(self) -> List[Tuple[Any, str]]:
+        factory = self.factory
+        now = time.time()
+        orphans = []
+        with factory._sandbox_lock:
+            endpoints = list(factory.endpoints.values())
+        for endpoint in endpoints:
+            try:
+                containers = endpoint.client.containers.list(all=True, filters={
+                    "label": f"{LABEL_FACTORY}={factory.config.factory_name}"
+                })
+            except Exception as e:
+                logger.warning("列出端点 %s 的容器失败: %s", endpoint.name, e)
+                continue
+            with factory._sandbox_lock:
+                tracked = set(factory._containers)
+                pending = set(factory._pending)
+            for container in containers:
+                if container.id in tracked or container.labels.get(LABEL_SESSION) in pending:
+                    continue
+                if now - _parse_created(container.attrs.get("Created", "")) < self.orphan_grace:
+                    continue
+                orphans.append((endpoint, container.id))
+        return orphans
+
+    def _reclaim(self, kind: str, endpoint, container_id: str,
+                 sandbox) -> Tuple[str, str, Dict[str, float], Optional[str]]:
+        """
+        强制删除一个容器并返回其释放的资源
+        """
+        name = sandbox.session_id if sandbox is not None else container_id
+        resources = {"cpus": 0.0, "memory_limit": 0, "memory_usage": 0}
+        try:
+            client = endpoint.client if endpoint is not None else self.factory.client
+            container = client.containers.get(container_id)
+            resources = _container_resources(container)
+            container.remove(force=True)
+        except docker.errors.NotFound:
+            pass
+        except Exception as e:
+            return kind, name, resources, str(e)
+        if sandbox is not None:
+            self.factory._set_state(sandbox, "removed")
+        return kind, name, resources, None
+
+    def _prune_fork_images(self) -> List[str]:
+        """
+        删除本工厂创建、且已没有容器使用的分叉快照镜像
+        """
+        factory = self.factory
+        removed = []
+        with factory._sandbox_lock:
+            endpoints = list(factory.endpoints.values())
+        for endpoint in endpoints:
+            try:
+                images = endpoint.client.images.list(filters={
+                    "label": [f"{LABEL_FACTORY}={factory.config.factory_name}", LABEL_FORK_OF]
+                })
+                if not images:
+                    continue
+                in_use = {container.attrs.get("Image")
+                          for container in endpoint.client.containers.list(all=True)}
+            except Exception as e:
+                logger.warning("列出端点 %s 的快照镜像失败: %s", endpoint.name, e)
+                continue
+            for image in images:
+                if image.id in in_use:
+                    continue
+                if time.time() - _parse_created(image.attrs.get("Created", "")) < self.orphan_grace:
+                    # 刚提交、副本尚未启动的快照
+                    continue
+                try:
+                    endpoint.client.images.remove(image.id)
+                    removed.append(image.id)
+                except docker.errors.APIError:
+                    pass
+        return removed
@@ -0,0 +1,208 @@
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from typing import Any, Deque, Dict, Iterator, Optional
+
+
+class _Ticket:
+    """
+    排队中的一次请求
+    """
+    def __init__(self, session_id: str):
+        self.session_id = session_id
+        self.enqueued_at = time.monotonic()
+        self.granted = False
+        self.event = threading.Event()
+
+
+class FairScheduler:
+    """
+    沙盒操作的并发限制与公平调度器
+
+    限制全局和单个会话同时进行的 exec、文件传输数量；名额不足时按会话加权轮转分配，
+    单个会话一次最多连续获得与其权重相同数量的名额，少数会话大量提交请求时不会饿死其他会话。
+    """
+    def __init__(self, global_limit: Optional[int] = None, session_limit: Optional[int] = None,
+                 sample_size: int = 1024):
+        """
+        参数:
+            global_limit: 全局最大并发数，None表示不限制
+            session_limit: 单个会话最大并发数，None表示不限制
+            sample_size: 用于统计排队时间的最近样本数
+        """
+        self.global_limit = global_limit
+        self.session_limit = session_limit
+        self._lock = threading.Lock()
+        self._inflight_total = 0
+        self._inflight: Dict[str, int] = {}
+        self._queues: Dict[str, Deque[_Ticket]] = {}
+        self._round: Deque[str] = deque()  # 有请求排队的会话，按轮转顺序
+        self._weights: Dict[str, int] = {}
+        self._credits: Dict[str, int] = {}
+        self._queue_times: Deque[float] = deque(maxlen=sample_size)
+        self._timeouts = 0  # 排队超时的请求总数
+
+    @property
+    def limited(self) -> bool:
+        """
+        是否配置了任何并发限制，未配置时调用方可以完全跳过调度
+        """
+        return self.global_limit is not None or self.session_limit is not None
+
+    def set_weight(self, session_id: str, weight: int) -> None:
+        """
+        设置会话的调度权重（默认1）
+        """
+        with self._lock:
+            self._weights[session_id] = max(int(weight), 1)
+
+    def forget(self, session_id: str) -> None:
+        """
+        清除会话的权重设置，会话删除时调用
+        """
+        with self._lock:
+            self._weights.pop(session_id, None)
+
+    def acquire(self, session_id: str, timeout: Optional[float] = None) -> float:
+        """
+        获取一个名额，名额不足时排队等待
+
+        参数:
+            session_id: 会话ID
+            timeout: 最长排队时间（秒），None表示一直等待
+
+        返回:
+            排队时间（秒）；超时时抛出 TimeoutError
+        """
+        with self._lock:
+            if not self._round and self._has_room(session_id):
+                self._grant(session_id)
+                self._queue_times.append(0.0)
+                return 0.0
+            ticket = _Ticket(session_id)
+            self._queues.setdefault(session_id, deque()).append(ticket)
+            if session_id not in self._round:
+                self._round.append(session_id)
+            self._dispatch()
+
+        if not ticket.event.wait(timeout):
+            with self._lock:
+                if not ticket.granted:
+                    self._remove_ticket(ticket)
+                    # 超时请求的等待时间同样计入样本，否则分位数会漏掉最差的尾部
+                    self._queue_times.append(time.monotonic() - ticket.enqueued_at)
+                    self._timeouts += 1
+                    raise TimeoutError(f"会话 {session_id} 排队超过 {timeout} 秒")
+
+        queue_time = time.monotonic() - ticket.enqueued_at
+        with self._lock:
+            self._queue_times.append(queue_time)
+        return queue_time
+
+    def release(self, session_id: str) -> None:
+        """
+        归还一个名额并唤醒下一个排队的请求
+        """
+        with self._lock:
+            self._inflight_total = max(self._inflight_total - 1, 0)
+            count = self._inflight.get(session_id, 0) - 1
+            if count > 0:
+                self._inflight[session_id] = count
+            else:
+                self._inflight.pop(session_id, None)
+            self._dispatch()
+
+    @contextmanager
+    def slot(self, session_id: str, timeout: Optional[float] = None) -> Iterator[float]:
+        """
+        以上下文管理器的形式占用一个名额，产出排队时间
+        """
+        queue_time = self.acquire(session_id, timeout)
+        try:
+            yield queue_time
+        finally:
+            self.release(session_id)
+
+    def stats(self) -> Dict[str, Any]:
+        """
+        返回当前并发数、排队数、排队超时总数和最近请求的排队时间分位数（秒），
+        分位数包含超时请求的等待时间
+        """
+        with self._lock:
+            samples = sorted(self._queue_times)
+            queued = sum(len(queue) for queue in self._queues.values())
+            inflight = self._inflight_total
+            timeouts = self._timeouts
+
+        def percentile(p: float) -> float:
+            if not samples:
+                return 0.0
+            return samples[min(int(p * len(samples)), len(samples) - 1)]
+
+        return {
+            "inflight": inflight,
+            "queued": queued,
+            "timeouts": timeouts,
+            "queue_time_p50": percentile(0.50),
+            "queue_time_p95": percentile(0.95),
+            "queue_time_p99": percentile(0.99),
+            "queue_time_max": samples[-1] if samples else 0.0,
+        }
+
+    def _has_room(self, session_id: str) -> bool:
+        if self.global_limit is not None and self._inflight_total >= self.global_limit:
+            return False
+        if self.session_limit is not None and self._inflight.get(session_id, 0) >= self.session_limit:
+            return False
+        return True
+
+    def _grant(self, session_id: str) -> None:
+        self._inflight_total += 1
+        self._inflight[session_id] = self._inflight.get(session_id, 0) + 1
+
+    def _dispatch(self) -> None:
+        """
+        按加权轮转顺序把空闲名额分配给排队的请求，调用时需持有锁
+        """
+        skipped = 0
+        while self._round and skipped < len(self._round):
+            if self.global_limit is not None and self._inflight_total >= self.global_limit:
+                return
+            session_id = self._round[0]
+            if not self._has_room(session_id):
+                # 该会话已达到自身上限，轮到下一个会话
+                self._round.rotate(-1)
+                skipped += 1
+                continue
+
+            queue = self._queues[session_id]
+            ticket = queue.popleft()
+            ticket.granted = True
+            self._grant(session_id)
+            ticket.event.set()
+            skipped = 0
+
+            credits = self._credits.get(session_id, self._weights.get(session_id, 1)) - 1
+            if not queue:
+                del self._queues[session_id]
+                self._credits.pop(session_id, None)
+                self._round.popleft()
+            elif credits <= 0:
+                self._credits.pop(session_id, None)
+                self._round.rotate(-1)
+            else:
+                self._credits[session_id] = credits
+
+    def _remove_ticket(self, ticket: _Ticket) -> None:
+        queue = self._queues.get(ticket.session_id)
+        if queue is None:
+            return
+        try:
+            queue.remove(ticket)
+        except ValueError:
+            return
+        if not queue:
+            del self._queues[ticket.session_id]
+            self._credits.pop(ticket.session_id, None)
+            self._round.remove(ticket.session_id)
@@ -0,0 +1,75 @@
+import os
+import struct
+from dataclasses import dataclass
+from typing import IO, Iterator, Optional
+
+# 与容器内 screen_capture.py 的帧头格式保持一致
+FRAME_HEADER = struct.Struct("!4sBHHHHHHI")
+FRAME_MAGIC = b"SBXF"
+FLAG_KEYFRAME = 0x01
+
+# 宿主机上的采集脚本，以及上传到容器后的路径
+HELPER_HOST_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "screen_capture.py")
+HELPER_CONTAINER_DIR = "/tmp"
+HELPER_CONTAINER_PATH = f"{HELPER_CONTAINER_DIR}/screen_capture.py"
+
+
+@dataclass
+class ScreenFrame:
+    """
+    一帧屏幕画面
+
+    关键帧包含完整画面；增量帧只包含 (x, y, width, height) 区域内变化后的图像，
+    需要叠加到之前的画面上。
+    """
+    # 是否为完整画面
+    keyframe: bool
+    # 屏幕尺寸
+    screen_width: int
+    screen_height: int
+    # 图像在屏幕中的区域
+    x: int
+    y: int
+    width: int
+    height: int
+    # 图像格式: png 或 jpeg
+    format: str
+    # 编码后的图像数据
+    data: bytes
+
+
+def _read_exact(stream: IO[bytes], size: int) -> Optional[bytes]:
+    """
+    从流中读取恰好 size 字节，流提前结束时返回None
+    """
+    chunks = []
+    remaining = size
+    while remaining > 0:
+        chunk = stream.read(remaining)
+        if not chunk:
+            return None
+        chunks.append(chunk)
+        remaining -= len(chunk)
+    return b"".join(chunks) if len(chunks) != 1 else chunks[0]
+
+
+def read_frames(stream: IO[bytes], fmt: str) -> Iterator[ScreenFrame]:
+    """
+    从采集脚本的输出流中逐帧解析画面
+
+    参数:
+        stream: 二进制输出流
+        fmt: 图像格式
+    """
+    while True:
+        header = _read_exact(stream, FRAME_HEADER.size)
+        if header is None:
+            return
+        magic, flags, screen_width, screen_height, x, y, width, height, length = FRAME_HEADER.unpack(header)
+        if magic != FRAME_MAGIC:
+            raise ValueError("屏幕帧数据格式错误")
+        data = _read_exact(stream, length)
+        if data is None:
+            return
+        yield ScreenFrame(bool(flags & FLAG_KEYFRAME), screen_width, screen_height,
+                          x, y, width, height, fmt, data)
@@ -0,0 +1,91 @@
+"""
+沙盒容器内运行的屏幕采集脚本，由 Sandbox.screen_stream 上传到容器中执行
+
+从X显示器抓取画面，编码后以二进制帧写入标准输出。每帧由固定长度的帧头和图像数据组成，
+帧头格式见 FRAME_HEADER（与宿主机端 screen.py 保持一致）。开启增量模式时只编码发生变化的
+矩形区域，画面没有变化时不输出任何数据。
+
+依赖: Pillow (需支持XCB，ImageGrab.grab(xdisplay=...))
+"""
+import argparse
+import io
+import struct
+import sys
+import time
+
+from PIL import ImageChops, ImageGrab
+
+# 帧头: 魔数, 标志位, 屏幕宽, 屏幕高, 区域x, 区域y, 区域宽, 区域高, 数据长度
+FRAME_HEADER = struct.Struct("!4sBHHHHHHI")
+FRAME_MAGIC = b"SBXF"
+FLAG_KEYFRAME = 0x01
+
+
+def encode(image, fmt: str, quality: int) -> bytes:
+    buffer = io.BytesIO()
+    if fmt == "jpeg":
+        image.save(buffer, format="JPEG", quality=quality)
+    else:
+        # 屏幕画面颜色较少，compress_level=1 在体积和CPU之间取得较好平衡
+        image.save(buffer, format="PNG", compress_level=1)
+    return buffer.getvalue()
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--display", default=":1")
+    parser.add_argument("--fps", type=float, default=2.0)
+    parser.add_argument("--format", choices=["png", "jpeg"], default="jpeg")
+    parser.add_argument("--quality", type=int, default=70)
+    parser.add_argument("--count", type=int, default=0, help="输出的帧数，0表示持续输出")
+    parser.add_argument("--delta", action="store_true", help="只输出变化的区域")
+    parser.add_argument("--keyframe-interval", type=int, default=0,
+                        help="每隔多少次采集强制输出一次完整画面，0表示只在开始时输出")
+    args = parser.parse_args()
+
+    out = sys.stdout.buffer
+    interval = 1.0 / args.fps if args.fps > 0 else 0.0
+    previous = None
+    emitted = 0
+    captured = 0
+    next_time = time.monotonic()
+
+    while args.count <= 0 or emitted < args.count:
+        image = ImageGrab.grab(xdisplay=args.display).convert("RGB")
+        width, height = image.size
+        keyframe = (previous is None or not args.delta or
+                    (args.keyframe_interval > 0 and captured % args.keyframe_interval == 0))
+
+        if keyframe:
+            box = (0, 0, width, height)
+        else:
+            box = ImageChops.difference(previous, image).getbbox()
+
+        if box is not None:
+            region = image if keyframe else image.crop(box)
+            data = encode(region, args.format, args.quality)
+            out.write(FRAME_HEADER.pack(
+                FRAME_MAGIC, FLAG_KEYFRAME if keyframe else 0, width, height,
+                box[0], box[1], box[2] - box[0], box[3] - box[1], len(data)
+            ))
+            out.write(data)
+            out.flush()
+            emitted += 1
+
+        previous = image
+        captured += 1
+        if interval:
+            next_time += interval
+            delay = next_time - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+            else:
+                # 采集跟不上目标帧率时不累积延迟
+                next_time = time.monotonic()
+
+
+if __name__ == "__main__":
+    try:
+        main()
+    except (BrokenPipeError, KeyboardInterrupt):
+        pass
@@ -0,0 +1,314 @@
+import argparse
+import codecs
+import hmac
+import json
+import logging
+import os
+import tarfile
+import uuid
+from typing import IO, Iterator, Optional
+
+from docker.errors import NotFound
+from flask import Flask, Response, jsonify, request, stream_with_context
+
+from config import SandboxConfig
+from sandbox import Sandbox, SandboxFactory, SandboxRemovedError
+from tracing import configure_logging
+
+logger = logging.getLogger(__name__)
+
+# 流式传输的数据块大小
+CHUNK_SIZE = 64 * 1024
+
+
+def _sandbox_info(sandbox: Sandbox) -> dict:
+    return {
+        "session_id": sandbox.session_id,
+        "container_id": sandbox.container_id,
+        "host_port": sandbox.host_port,
+        "endpoint": sandbox.endpoint.name if sandbox.endpoint is not None else None,
+        "state": sandbox.state,
+        "ready": sandbox.ready,
+    }
+
+
+def _error(message: str, status: int):
+    return jsonify({"error": message}), status
+
+
+def _sandbox_error(action: str, e: Exception):
+    """
+    按异常类型返回exec或文件传输失败的响应：排队超时为503，沙盒已删除为410，路径不存在为404
+    """
+    if isinstance(e, TimeoutError):
+        response = _error(f"{action}排队超时: {e}", 503)
+        response[0].headers["Retry-After"] = "1"
+        return response
+    if isinstance(e, SandboxRemovedError):
+        return _error(str(e), 410)
+    if isinstance(e, NotFound):
+        return _error(f"{action}时出错: {e}", 404)
+    return _error(f"{action}时出错: {e}", 500)
+
+
+def _tar_single_file(name: str, size: int, stream: IO[bytes]) -> Iterator[bytes]:
+    """
+    将请求体边读边封装为只含一个文件的tar流，不在内存中缓存整个文件
+
+    参数:
+        name: 归档内的文件名
+        size: 文件大小（字节），必须与请求体长度一致
+        stream: 请求体输入流
+    """
+    info = tarfile.TarInfo(name=name)
+    info.size = size
+    info.mode = 0o644
+    yield info.tobuf(format=tarfile.GNU_FORMAT)
+
+    remaining = size
+    while remaining > 0:
+        chunk = stream.read(min(CHUNK_SIZE, remaining))
+        if not chunk:
+            raise IOError(f"请求体长度不足，还差 {remaining} 字节")
+        remaining -= len(chunk)
+        yield chunk
+
+    # 补齐到512字节边界并写入两个空块作为归档结尾
+    padding = (tarfile.BLOCKSIZE - size % tarfile.BLOCKSIZE) % tarfile.BLOCKSIZE
+    yield tarfile.NUL * (padding + 2 * tarfile.BLOCKSIZE)
+
+
+def _iter_request_body(stream: IO[bytes]) -> Iterator[bytes]:
+    while True:
+        chunk = stream.read(CHUNK_SIZE)
+        if not chunk:
+            break
+        yield chunk
+
+
+def create_app(config: Optional[SandboxConfig] = None, token: Optional[str] = None) -> Flask:
+    """
+    创建包装 SandboxFactory 的HTTP服务
+
+    同一进程内的所有请求共享一个已初始化的工厂实例。
+
+    参数:
+        config: 沙盒配置对象，仅在工厂首次创建时使用
+        token: 访问令牌，设置后所有请求必须携带 Authorization: Bearer <token>
+    """
+    app = Flask(__name__)
+    factory = SandboxFactory.get_instance(config)
+
+    if token:
+        expected = f"Bearer {token}".encode('utf-8')
+
+        @app.before_request
+        def check_token():
+            provided = request.headers.get("Authorization", "").encode('utf-8')
+            if not hmac.compare_digest(provided, expected):
+                return _error("未授权", 401)
+
+    def get_sandbox(session_id: str) -> Optional[Sandbox]:
+        return factory.sandboxes.get(session_id)
+
+    @app.route("/sessions", methods=["POST"])
+    def create_session():
+        body = request.get_json(silent=True) or {}
+        session_id = body.get("session_id") or uuid.uuid4().hex
+        sandbox = factory.run(
+            session_id,
+            host_port=body.get("host_port"),
+            wait_ready=bool(body.get("wait_ready", False)),
+            ready_timeout=body.get("ready_timeout")
+        )
+        if sandbox is None:
+            return _error(f"创建沙盒失败: session_id={session_id}", 503)
+        return jsonify(_sandbox_info(sandbox)), 201
+
+    @app.route("/sessions", methods=["GET"])
+    def list_sessions():
+        return jsonify([_sandbox_info(sandbox) for sandbox in factory.list()])
+
+    @app.route("/stats", methods=["GET"])
+    def scheduler_stats():
+        return jsonify(factory.scheduler.stats())
+
+    @app.route("/sessions/<session_id>", methods=["GET"])
+    def get_session(session_id: str):
+        sandbox = get_sandbox(session_id)
+        if sandbox is None:
+            return _error(f"会话 {session_id} 不存在", 404)
+        return jsonify(_sandbox_info(sandbox))
+
+    @app.route("/sessions/<session_id>", methods=["DELETE"])
+    def delete_session(session_id: str):
+        if get_sandbox(session_id) is None:
+            return _error(f"会话 {session_id} 不存在", 404)
+        if not factory.remove(session_id):
+            return _error(f"删除沙盒失败: session_id={session_id}", 500)
+        return "", 204
+
+    @app.route("/sessions/<session_id>/exec", methods=["POST"])
+    def exec_command(session_id: str):
+        """
+        流式执行命令，响应为分块传输的NDJSON：
+        若干行 {"output": "..."}，最后一行 {"exit_code": n}
+        """
+        sandbox = get_sandbox(session_id)
+        if sandbox is None:
+            return _error(f"会话 {session_id} 不存在", 404)
+        body = request.get_json(silent=True) or {}
+        command = body.get("command")
+        shell = bool(body.get("shell", False))
+        if not command:
+            return _error("缺少 command 参数", 400)
+        if isinstance(command, str):
+            if not shell:
+                return _error("command 为字符串时必须指定 shell=true", 400)
+        elif not isinstance(command, list) or not all(isinstance(arg, str) for arg in command):
+            return _error("command 必须是字符串列表", 400)
+        env = body.get("env")
+        if env is not None and (not isinstance(env, dict) or
+                                not all(isinstance(value, str) for value in env.values())):
+            return _error("env 必须是字符串到字符串的映射", 400)
+        cwd = body.get("cwd")
+        if cwd is not None and not isinstance(cwd, str):
+            return _error("cwd 必须是字符串", 400)
+
+        process = sandbox.exec(
+            command,
+            shell=shell,
+            env=env,
+            cwd=cwd,
+            universal_newlines=False
+        )
+        error = getattr(process, "error", None)
+        if isinstance(error, Exception):
+            # 命令未能启动（排队超时、沙盒已删除等），在开始流式响应前返回错误
+            return _sandbox_error("执行命令", error)
+
+        def generate() -> Iterator[str]:
+            decoder = codecs.getincrementaldecoder("utf-8")(errors="replace")
+            finished = False
+            try:
+                read = getattr(process.stdout, "read1", process.stdout.read)
+                while True:
+                    chunk = read(CHUNK_SIZE)
+                    if not chunk:
+                        break
+                    text = decoder.decode(chunk)
+                    if text:
+                        yield json.dumps({"output": text}, ensure_ascii=False) + "\n"
+                text = decoder.decode(b"", final=True)
+                if text:
+                    yield json.dumps({"output": text}, ensure_ascii=False) + "\n"
+                finished = True
+                yield json.dumps({"exit_code": process.wait()}) + "\n"
+            finally:
+                if not finished and process.poll() is None:
+                    # 客户端断开连接时终止命令
+                    process.kill()
+                    process.wait()
+
+        return Response(stream_with_context(generate()), mimetype="application/x-ndjson")
+
+    @app.route("/sessions/<session_id>/files", methods=["PUT"])
+    def upload_files(session_id: str):
+        """
+        流式上传文件到容器的 path 目录
+
+        Content-Type 为 application/x-tar 时请求体作为tar归档直接解压；
+        否则请求体作为单个文件，以 filename 参数命名，此时必须提供 Content-Length。
+        """
+        sandbox = get_sandbox(session_id)
+        if sandbox is None:
+            return _error(f"会话 {session_id} 不存在", 404)
+        container_path = request.args.get("path")
+        if not container_path:
+            return _error("缺少 path 参数", 400)
+
+        if request.mimetype == "application/x-tar":
+            data = _iter_request_body(request.stream)
+        else:
+            filename = request.args.get("filename")
+            if not filename or request.content_length is None:
+                return _error("单文件上传需要 filename 参数和 Content-Length", 400)
+            data = _tar_single_file(os.path.basename(filename), request.content_length, request.stream)
+
+        try:
+            if not sandbox.put_archive(container_path, data):
+                return _error("上传文件失败", 500)
+        except Exception as e:
+            return _sandbox_error("上传文件", e)
+        return "", 204
+
+    @app.route("/sessions/<session_id>/files", methods=["GET"])
+    def download_files(session_id: str):
+        """
+        以tar归档流的形式下载容器中的文件或目录
+        """
+        sandbox = get_sandbox(session_id)
+        if sandbox is None:
+            return _error(f"会话 {session_id} 不存在", 404)
+        container_path = request.args.get("path")
+        if not container_path:
+            return _error("缺少 path 参数", 400)
+        try:
+            chunks, stat = sandbox.get_archive(container_path, chunk_size=CHUNK_SIZE)
+        except Exception as e:
+            return _sandbox_error("下载文件", e)
+        response = Response(chunks, mimetype="application/x-tar")
+        response.headers["X-Sandbox-Stat"] = json.dumps(stat, ensure_ascii=True)
+        return response
+
+    return app
+
+
+def main():
+    parser = argparse.ArgumentParser(description="沙盒HTTP服务")
+    parser.add_argument("--host", default="127.0.0.1",
+                        help="监听地址，默认只接受本机连接")
+    parser.add_argument("--port", type=int, default=5000)
+    parser.add_argument("--threads", type=int, default=512, help="处理请求的线程数")
+    parser.add_argument("--image-name", default=os.environ.get("SANDBOX_IMAGE_NAME", "sandbox"))
+    parser.add_argument("--image-tag", default=os.environ.get("SANDBOX_IMAGE_TAG", "2.0.0"))
+    parser.add_argument("--token", default=os.environ.get("SANDBOX_API_TOKEN"),
+                        help="访问令牌，请求需携带 Authorization: Bearer <token>")
+    parser.add_argument("--log-level", default=os.environ.get("SANDBOX_LOG_LEVEL", "INFO"),
+                        help="日志级别，DEBUG时输出每次exec和文件传输的详细信息")
+    parser.add_argument("--log-format", choices=["text", "json"],
+                        default=os.environ.get("SANDBOX_LOG_FORMAT", "text"),
+                        help="日志格式，json时每行一个JSON对象，包含 session_id、container_id 等字段")
+    parser.add_argument("--trace-file", default=os.environ.get("SANDBOX_TRACE_FILE"),
+                        help="追踪数据写入的JSON Lines文件")
+    parser.add_argument("--trace-collector-url", default=os.environ.get("SANDBOX_TRACE_COLLECTOR_URL"),
+                        help="追踪数据上报地址")
+    args = parser.parse_args()
+    configure_logging(args.log_level, json_format=args.log_format == "json")
+
+    config = SandboxConfig(
+        image_name=args.image_name,
+        image_tag=args.image_tag,
+        network_disabled=False,
+        # 每个处理线程都可能占用一个Docker连接（流式文件传输）
+        docker_pool_size=args.threads,
+        trace_file=args.trace_file,
+        trace_collector_url=args.trace_collector_url
+    )
+    app = create_app(config, token=args.token)
+    if not args.token and args.host not in ("127.0.0.1", "localhost", "::1"):
+        logger.warning("服务监听在 %s 且未设置访问令牌，任何能访问该地址的客户端都可以创建容器和执行命令", args.host)
+
+    try:
+        # 优先使用 waitress：固定大小的线程池，适合大量长连接的流式请求
+        from waitress import serve
+        logger.info("使用 waitress 启动服务: %s:%s, 线程数 %s", args.host, args.port, args.threads)
+        serve(app, host=args.host, port=args.port, threads=args.threads,
+              connection_limit=args.threads * 2, channel_timeout=3600)
+    except ImportError:
+        logger.info("未安装 waitress，使用 Flask 多线程服务器启动: %s:%s", args.host, args.port)
+        app.run(host=args.host, port=args.port, threaded=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,312 @@
+import contextvars
+import json
+import logging
+import os
+import queue
+import threading
+import time
+import urllib.request
+import uuid
+from typing import Any, Dict, List, Optional, Union
+
+logger = logging.getLogger(__name__)
+
+# 当前线程/协程中正在进行的span，用于建立父子关系
+_current_span: contextvars.ContextVar[Optional['Span']] = contextvars.ContextVar("sandbox_span", default=None)
+
+
+class Span:
+    """
+    一次被追踪的操作，可以嵌套子span记录各阶段耗时
+    """
+    __slots__ = ("tracer", "name", "trace_id", "span_id", "parent_id", "attributes",
+                 "start_time", "_start", "duration", "error", "_token")
+
+    def __init__(self, tracer: 'Tracer', name: str, attributes: Dict[str, Any]):
+        parent = _current_span.get()
+        self.tracer = tracer
+        self.name = name
+        self.trace_id = parent.trace_id if parent is not None else uuid.uuid4().hex
+        self.span_id = uuid.uuid4().hex[:16]
+        self.parent_id = parent.span_id if parent is not None else None
+        if parent is not None:
+            # 子span继承会话ID、容器ID等上下文属性
+            merged = {key: value for key, value in parent.attributes.items()
+                      if key in ("session_id", "container_id", "endpoint")}
+            merged.update(attributes)
+            attributes = merged
+        self.attributes = attributes
+        self.start_time = 0.0
+        self._start = 0.0
+        self.duration = 0.0
+        self.error: Optional[str] = None
+        self._token = None
+
+    def set_attribute(self, key: str, value: Any) -> None:
+        self.attributes[key] = value
+
+    def phase(self, name: str, **attributes) -> 'Span':
+        """
+        创建子span，用于记录某个阶段（如打包、API调用、解压）的耗时
+        """
+        return self.tracer.span(name, **attributes)
+
+    def start(self) -> 'Span':
+        """
+        开始计时但不设为当前span，用于跨越函数返回的操作（如流式下载），需配合 end() 使用
+        """
+        self.start_time = time.time()
+        self._start = time.perf_counter()
+        return self
+
+    def end(self, exc: Optional[BaseException] = None) -> None:
+        """
+        结束计时并导出span
+        """
+        self.duration = time.perf_counter() - self._start
+        if exc is not None:
+            self.error = f"{type(exc).__name__}: {exc}"
+        self.tracer._finish(self)
+
+    def __enter__(self) -> 'Span':
+        self.start()
+        self._token = _current_span.set(self)
+        return self
+
+    def __exit__(self, exc_type, exc, tb) -> bool:
+        _current_span.reset(self._token)
+        self.end(exc)
+        return False
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "name": self.name,
+            "trace_id": self.trace_id,
+            "span_id": self.span_id,
+            "parent_id": self.parent_id,
+            "start_time": self.start_time,
+            "duration_ms": round(self.duration * 1000, 3),
+            "attributes": self.attributes,
+            "error": self.error,
+        }
+
+
+class _NoopSpan:
+    """
+    追踪关闭时使用的空span，所有操作都不做任何事
+    """
+    __slots__ = ()
+
+    def set_attribute(self, key: str, value: Any) -> None:
+        pass
+
+    def phase(self, name: str, **attributes) -> '_NoopSpan':
+        return self
+
+    def start(self) -> '_NoopSpan':
+        return self
+
+    def end(self, exc: Optional[BaseException] = None) -> None:
+        pass
+
+    def __enter__(self) -> '_NoopSpan':
+        return self
+
+    def __exit__(self, exc_type, exc, tb) -> bool:
+        return False
+
+
+NOOP_SPAN = _NoopSpan()
+
+
+class SpanExporter:
+    """
+    批量导出span的基类，在后台线程中写出，不阻塞被追踪的操作
+    """
+    def __init__(self, batch_size: int = 256, flush_interval: float = 1.0, max_queue: int = 65536):
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self._queue: "queue.Queue[Dict[str, Any]]" = queue.Queue(maxsize=max_queue)
+        self._dropped = 0
+        self._thread = threading.Thread(target=self._loop, name=f"{type(self).__name__}", daemon=True)
+        self._thread.start()
+
+    def export(self, span: Dict[str, Any]) -> None:
+        try:
+            self._queue.put_nowait(span)
+        except queue.Full:
+            # 导出跟不上时丢弃，不影响业务操作
+            self._dropped += 1
+
+    def _loop(self) -> None:
+        while True:
+            batch: List[Dict[str, Any]] = [self._queue.get()]
+            deadline = time.monotonic() + self.flush_interval
+            while len(batch) < self.batch_size:
+                timeout = deadline - time.monotonic()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(self._queue.get(timeout=timeout))
+                except queue.Empty:
+                    break
+            try:
+                self._write(batch)
+            except Exception as e:
+                logger.warning("导出追踪数据失败 (%d 条): %s", len(batch), e)
+            if self._dropped:
+                logger.warning("追踪数据队列已满，丢弃 %d 条", self._dropped)
+                self._dropped = 0
+
+    def _write(self, batch: List[Dict[str, Any]]) -> None:
+        raise NotImplementedError
+
+
+class FileSpanExporter(SpanExporter):
+    """
+    以JSON Lines格式将span追加写入本地文件
+    """
+    def __init__(self, path: str, **kwargs):
+        self.path = path
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+        super().__init__(**kwargs)
+
+    def _write(self, batch: List[Dict[str, Any]]) -> None:
+        with open(self.path, 'a', encoding='utf-8') as f:
+            for span in batch:
+                f.write(json.dumps(span, ensure_ascii=False, default=str))
+                f.write("\n")
+
+
+class HttpSpanExporter(SpanExporter):
+    """
+    将span批量以JSON数组POST到采集服务
+    """
+    def __init__(self, url: str, timeout: float = 5.0, **kwargs):
+        self.url = url
+        self.timeout = timeout
+        super().__init__(**kwargs)
+
+    def _write(self, batch: List[Dict[str, Any]]) -> None:
+        body = json.dumps(batch, ensure_ascii=False, default=str).encode('utf-8')
+        req = urllib.request.Request(self.url, data=body, method="POST",
+                                     headers={"Content-Type": "application/json"})
+        with urllib.request.urlopen(req, timeout=self.timeout) as response:
+            response.read()
+
+
+# 日志记录中作为结构化字段输出的上下文属性
+LOG_CONTEXT_FIELDS = ("session_id", "container_id", "endpoint")
+
+
+class ContextLogger(logging.LoggerAdapter):
+    """
+    为日志记录附加会话ID、容器ID等上下文字段，调用时传入的 extra 与绑定的上下文合并
+    """
+    def process(self, msg, kwargs):
+        extra = kwargs.get("extra")
+        kwargs["extra"] = {**self.extra, **extra} if extra else self.extra
+        return msg, kwargs
+
+
+class JsonLogFormatter(logging.Formatter):
+    """
+    以每行一个JSON对象的格式输出日志，上下文字段作为独立的键，便于按会话或容器过滤和聚合
+    """
+    def format(self, record: logging.LogRecord) -> str:
+        data = {
+            "time": self.formatTime(record),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+        }
+        for field in LOG_CONTEXT_FIELDS:
+            value = getattr(record, field, None)
+            if value is not None:
+                data[field] = value
+        if record.exc_info:
+            data["exception"] = self.formatException(record.exc_info)
+        return json.dumps(data, ensure_ascii=False, default=str)
+
+
+def configure_logging(level: Union[int, str] = logging.INFO, json_format: bool = False) -> None:
+    """
+    配置根日志记录器，供命令行入口使用
+
+    参数:
+        level: 日志级别
+        json_format: 是否以JSON格式输出（包含 session_id、container_id、endpoint 字段）
+    """
+    handler = logging.StreamHandler()
+    if json_format:
+        handler.setFormatter(JsonLogFormatter())
+    else:
+        handler.setFormatter(logging.Formatter("%(asctime)s %(levelname)s %(name)s: %(message)s"))
+    logging.basicConfig(level=level.upper() if isinstance(level, str) else level, handlers=[handler])
+
+
+class Tracer:
+    """
+    追踪器，未配置导出器时 span() 返回空span，开销只有一次属性判断
+    """
+    def __init__(self):
+        self.exporters: List[SpanExporter] = []
+
+    @property
+    def enabled(self) -> bool:
+        return bool(self.exporters)
+
+    def add_exporter(self, exporter: SpanExporter) -> None:
+        self.exporters.append(exporter)
+
+    def span(self, name: str, **attributes):
+        """
+        创建一个span，配合 with 语句使用
+
+        用法示例:
+            with tracer.span("sandbox.upload", session_id=sid) as span:
+                with span.phase("tar_build"):
+                    ...
+        """
+        if not self.exporters:
+            return NOOP_SPAN
+        return Span(self, name, attributes)
+
+    def _finish(self, span: Span) -> None:
+        data = span.to_dict()
+        for exporter in self.exporters:
+            exporter.export(data)
+
+
+_tracer = Tracer()
+
+
+def get_tracer() -> Tracer:
+    """
+    获取进程内共享的追踪器
+    """
+    return _tracer
+
+
+def current_span():
+    """
+    获取当前上下文中正在进行的span，没有时返回空span
+    """
+    span = _current_span.get()
+    return span if span is not None else NOOP_SPAN
+
+
+def configure_tracing(trace_file: Optional[str] = None, collector_url: Optional[str] = None) -> Tracer:
+    """
+    为共享追踪器添加导出器，两个参数都为None时追踪保持关闭
+
+    参数:
+        trace_file: 本地JSON Lines文件路径
+        collector_url: 采集服务地址，span以JSON数组POST到该地址
+    """
+    if trace_file:
+        _tracer.add_exporter(FileSpanExporter(trace_file))
+    if collector_url:
+        _tracer.add_exporter(HttpSpanExporter(collector_url))
+    return _tracer
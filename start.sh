@@ -12,9 +12,14 @@ echo "日志目录创建完成"
 # 记录启动时间
 echo "=== 容器启动时间: $(date) ===" > /var/log/vnc/start.log
 
+# 清理上次运行遗留的状态：分叉副本的文件系统来自运行中的容器，
+# 其中的X锁文件会导致 Xvfb 报 "Server is already active"，就绪文件也会在桌面启动前就存在
+rm -f /tmp/.X1-lock /tmp/.X11-unix/X1 /tmp/.sandbox_ready
+
 # 启动虚拟显示和 VNC
 echo "启动 Xvfb..."
-Xvfb :1 -screen 0 1280x720x16 &
+# 使用24位色深：Pillow 的 XCB 截屏只支持24位根窗口（16位时报 unsupported bit depth）
+Xvfb :1 -screen 0 1280x720x24 &
 echo "Xvfb 启动完成"
 
 export DISPLAY=:1
@@ -29,6 +34,25 @@ echo "启动 websockify..."
 websockify -D --web /usr/share/novnc 6080 localhost:5900 &
 echo "websockify 启动完成"
 
+# 等待端口开始监听
+wait_for_port() {
+    for _ in $(seq 1 300); do
+        if (echo > /dev/tcp/127.0.0.1/$1) >/dev/null 2>&1; then
+            return 0
+        fi
+        sleep 0.1
+    done
+    echo "等待端口 $1 超时"
+    return 1
+}
+
+echo "等待桌面服务就绪..."
+if wait_for_port 5900 && wait_for_port 6080; then
+    # 就绪标记：宿主机通过容器日志判断服务已可用，容器内的命令可以检查该文件
+    touch /tmp/.sandbox_ready
+    echo "SANDBOX_READY"
+fi
+
 # 保持容器运行
 echo "所有服务启动完成，保持容器运行"
 exec tail -f /var/log/vnc/start.log